@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Benchmark each pipeline stage in isolation
+Runs load_data, process_year, generate_sankey_data, calculate_wealth_scores
+and process_year_for_grid on the real waves and on synthetic waves of
+10^3-10^7 rows (synthetic_waves.py), recording time and peak memory
+(tracemalloc), and compares them with a stored baseline
+With --sav-dir, synthetic .sav files are benchmarked through load_data as well
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyreadstat
+
+import prepare_grid_visualization_data as grid_module
+import synthetic_waves
+
+pwd_module = grid_module.pwd_module
+
+BASELINE_FILE = Path('./benchmark_baseline.json')
+
+DEFAULT_SIZES = [10 ** 3, 10 ** 4, 10 ** 5]
+DEFAULT_SYNTHETIC_YEARS = [2022]
+
+# A stage regresses when its time or peak memory exceeds the baseline by this factor
+DEFAULT_TOLERANCE = 1.25
+
+# Stage timings below this are too noisy to flag (identical runs of a ~10 ms
+# stage vary by more than the tolerance on a busy or single-core machine)
+MIN_COMPARED_SECONDS = 0.02
+
+
+@contextlib.contextmanager
+def wave_source(year, wave):
+    """
+    Make pwd_module.load_data return an in-memory (df, meta) for year, so the
+    stages that load their own data can run on a synthetic wave.
+    """
+    original = pwd_module.load_data
+
+    def load_data(requested_year, usecols=None, use_cache=True):
+        if requested_year != year:
+            return original(requested_year, usecols, use_cache)
+        df, meta = wave
+        return (df if usecols is None else df[[c for c in usecols if c in df.columns]]), meta
+
+    pwd_module.load_data = load_data
+    try:
+        yield
+    finally:
+        pwd_module.load_data = original
+
+
+@contextlib.contextmanager
+def data_path(path):
+    """Read the .sav files from another directory (e.g. synthetic_waves.py output)"""
+    original = pwd_module.DATA_PATH
+    pwd_module.DATA_PATH = Path(path)
+    try:
+        yield
+    finally:
+        pwd_module.DATA_PATH = original
+
+
+def measure(func, repeat):
+    """
+    Best-of-repeat wall time and the peak traced memory of one extra run,
+    after an untimed warm-up run (first-call caches and allocations)
+    """
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {'seconds': min(times), 'peak_mb': peak / 2 ** 20}
+
+
+def stage_functions(year, records, include_load):
+    """The benchmarked stages for one wave; records feed the record-based stages"""
+    stages = {}
+    if include_load:
+        stages['load_data'] = lambda: pwd_module.load_data(year, use_cache=False)
+    stages.update({
+        'process_year': lambda: pwd_module.process_year(year),
+        'generate_sankey_data': lambda: pwd_module.generate_sankey_data(records, year),
+        'calculate_wealth_scores': lambda: pwd_module.calculate_wealth_scores(records),
+        # Without .gz/.br siblings: brotli quality 11 would dominate the grid aggregation
+        'process_year_for_grid': lambda: grid_module.process_year_for_grid(year, precompress=False)
+    })
+    return stages
+
+
+def rows_label(rows):
+    """1e5 for powers of ten, the plain count otherwise"""
+    exponent = int(round(np.log10(rows))) if rows > 0 else 0
+    return f'1e{exponent}' if 10 ** exponent == rows else str(rows)
+
+
+def benchmark_wave(dataset, year, rows, repeat, results, include_load):
+    """Benchmark every stage on one wave (the current load_data source) and record it"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        records = pwd_module.process_year(year)
+
+    for stage, func in stage_functions(year, records, include_load).items():
+        result = dict(measure(func, repeat), rows=rows)
+        results[f'{dataset}/{stage}'] = result
+        print(f"  {dataset:<22} {stage:<24} {rows:>10,} rows "
+              f"{result['seconds'] * 1000:>10.1f} ms {result['peak_mb']:>9.1f} MB "
+              f"{rows / result['seconds'] if result['seconds'] else 0:>12,.0f} rows/s")
+
+
+def run_benchmarks(real_years, synthetic_years, sizes, repeat, sav_dir=None):
+    """Run the stage benchmarks; returns {dataset/stage: {rows, seconds, peak_mb}}"""
+    results = {}
+
+    # Synthetic .sav files go through the real load_data, so every stage is measured
+    if sav_dir is not None:
+        with data_path(sav_dir):
+            for year in pwd_module.YEARS:
+                if not (pwd_module.DATA_PATH / pwd_module.FILE_MAPPING[year]).exists():
+                    continue
+                rows = pwd_module.load_metadata(year).number_rows
+                benchmark_wave(f'sav-{year}-{rows_label(rows)}', year, rows, repeat, results,
+                               include_load=True)
+
+    for year in real_years:
+        with contextlib.redirect_stdout(io.StringIO()):
+            rows = len(pwd_module.load_data(year)[0])
+        benchmark_wave(f'real-{year}', year, rows, repeat, results, include_load=True)
+
+    for year in synthetic_years:
+        with contextlib.redirect_stdout(io.StringIO()):
+            marginals = synthetic_waves.wave_marginals(year)
+        for rows in sizes:
+            wave = synthetic_waves.synthetic_wave(year, rows, marginals=marginals)
+            with wave_source(year, wave):
+                benchmark_wave(f'synthetic-{year}-{rows_label(rows)}', year, rows, repeat, results,
+                               include_load=False)
+
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Print the ratio to the baseline of every stage; returns the regressed keys"""
+    regressions = []
+    print(f"\n{'stage':<48} {'time':>8} {'memory':>8}")
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"{key:<48} {'new':>8}")
+            continue
+
+        time_ratio = result['seconds'] / base['seconds'] if base['seconds'] else 1.0
+        memory_ratio = result['peak_mb'] / base['peak_mb'] if base['peak_mb'] else 1.0
+        regressed = ((time_ratio > tolerance and result['seconds'] >= MIN_COMPARED_SECONDS) or
+                     memory_ratio > tolerance)
+        if regressed:
+            regressions.append(key)
+        print(f"{key:<48} {time_ratio:>7.2f}x {memory_ratio:>7.2f}x{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def load_baseline(baseline_file=BASELINE_FILE):
+    """Stored baseline results, empty if there is none"""
+    try:
+        with open(baseline_file, encoding='utf-8') as f:
+            return json.load(f)['results']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def save_baseline(results, baseline_file=BASELINE_FILE):
+    """Store results (with the machine they were measured on) as the new baseline"""
+    report = {
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'pyreadstat': pyreadstat.__version__,
+            'cpus': os.cpu_count()
+        },
+        'results': results
+    }
+    with open(baseline_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n✓ Saved baseline: {baseline_file}")
+
+
+def main(real_years=pwd_module.YEARS, synthetic_years=DEFAULT_SYNTHETIC_YEARS, sizes=DEFAULT_SIZES,
+         repeat=3, tolerance=DEFAULT_TOLERANCE, update_baseline=False, sav_dir=None):
+    print("=" * 60)
+    print("Pipeline stage benchmarks")
+    print("=" * 60)
+
+    # Stages that write outputs (process_year_for_grid) write to a scratch directory
+    with tempfile.TemporaryDirectory() as output_dir:
+        original_output = grid_module.OUTPUT_PATH
+        grid_module.OUTPUT_PATH = Path(output_dir)
+        try:
+            results = run_benchmarks(real_years, synthetic_years, sizes, repeat, sav_dir)
+        finally:
+            grid_module.OUTPUT_PATH = original_output
+
+    regressions = compare_with_baseline(results, load_baseline(), tolerance)
+    if update_baseline:
+        save_baseline(results)
+        return []
+    if regressions:
+        print(f"\n✗ {len(regressions)} stage(s) slower or larger than baseline × {tolerance}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark pipeline stages on real and synthetic waves.')
+    parser.add_argument('--years', type=int, nargs='*', default=pwd_module.YEARS,
+                        help='real waves to benchmark (default: all)')
+    parser.add_argument('--synthetic-years', type=int, nargs='*', default=DEFAULT_SYNTHETIC_YEARS,
+                        help='waves whose codebook the synthetic waves mimic')
+    parser.add_argument('--sizes', type=float, nargs='*', default=DEFAULT_SIZES,
+                        help='synthetic wave sizes in rows (e.g. 1e3 1e5 1e7)')
+    parser.add_argument('--sav-dir', type=Path, default=None,
+                        help='also benchmark every stage on the .sav files in this directory '
+                             '(written by synthetic_waves.py)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage (best is kept)')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='flag stages slower or larger than baseline times this factor')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help=f'store these results as the new baseline ({BASELINE_FILE})')
+    args = parser.parse_args()
+    regressions = main(real_years=args.years, synthetic_years=args.synthetic_years,
+                       sizes=[int(size) for size in args.sizes], repeat=args.repeat,
+                       tolerance=args.tolerance, update_baseline=args.update_baseline,
+                       sav_dir=args.sav_dir)
+    sys.exit(1 if regressions else 0)
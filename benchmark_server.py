@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Local concurrency benchmark for serve_data.py
+Starts the server in each mode and fires bursts of identical concurrent
+requests (as when a whole classroom opens the dashboard at once), then
+reports p50 / p99 latency and throughput per mode
+"""
+
+import argparse
+import asyncio
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# What the dashboard fetches when the map view opens, plus one query
+DEFAULT_PATHS = [
+    '/data/processed/grid_viz_data_2022.json',
+    '/map/Taiwan_TOWN_topo.json',
+    '/map/Taiwan_COUNTY_topo.json',
+    '/data/processed/wealth_cube.json',
+    '/api/query?group_by=year,county,subjective'
+]
+
+MODES = {'threaded': [], 'asyncio': ['--asyncio']}
+
+
+def free_port():
+    """An unused local TCP port"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, port, timeout=30):
+    """Start serve_data.py in a subprocess and wait until it accepts connections"""
+    server = subprocess.Popen([sys.executable, 'serve_data.py', str(port), '--bind', '127.0.0.1'] + MODES[mode],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"{mode} server did not start on port {port}")
+
+
+async def fetch(port, path):
+    """GET one path on a new connection; returns (latency in seconds, status)"""
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: gzip, br\r\n'
+                 f'Connection: close\r\n\r\n'.encode('latin-1'))
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status = int(response.split(b' ', 2)[1]) if response else 0
+    return time.perf_counter() - start, status
+
+
+async def run_bursts(port, paths, concurrency, rounds):
+    """Send `concurrency` simultaneous requests for each path, `rounds` times"""
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for path in paths:
+            results = await asyncio.gather(*(fetch(port, path) for _ in range(concurrency)),
+                                           return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception) or result[1] != 200:
+                    errors += 1
+                else:
+                    latencies.append(result[0])
+    return latencies, errors, time.perf_counter() - start
+
+
+def benchmark_mode(mode, paths, concurrency, rounds):
+    """Benchmark one server mode and return its latency summary"""
+    port = free_port()
+    server = start_server(mode, port)
+    try:
+        # Warm-up round so both modes start with the same hot files
+        asyncio.run(run_bursts(port, paths, 1, 1))
+        latencies, errors, elapsed = asyncio.run(run_bursts(port, paths, concurrency, rounds))
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'mode': mode,
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+        'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+        'max_ms': float(latencies.max()) if len(latencies) else None,
+        'requests_per_s': (len(latencies) + errors) / elapsed
+    }
+
+
+def main(modes=tuple(MODES), paths=DEFAULT_PATHS, concurrency=50, rounds=10):
+    print("=" * 60)
+    print(f"serve_data.py load test: {concurrency} concurrent clients, "
+          f"{rounds} rounds × {len(paths)} paths")
+    print("=" * 60)
+
+    results = [benchmark_mode(mode, paths, concurrency, rounds) for mode in modes]
+
+    print(f"\n{'mode':<10} {'requests':>9} {'errors':>7} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'req/s':>9}")
+    for r in results:
+        print(f"{r['mode']:<10} {r['requests']:>9} {r['errors']:>7} {r['p50_ms']:>9.2f} "
+              f"{r['p99_ms']:>9.2f} {r['max_ms']:>9.2f} {r['requests_per_s']:>9.0f}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load-test serve_data.py with concurrent identical requests.')
+    parser.add_argument('--mode', choices=list(MODES), action='append',
+                        help='server mode to test (repeatable; default: all)')
+    parser.add_argument('--concurrency', type=int, default=50, help='simultaneous requests per burst')
+    parser.add_argument('--rounds', type=int, default=10, help='bursts per path')
+    parser.add_argument('--path', action='append', help='path to request (repeatable; default: map view files)')
+    args = parser.parse_args()
+    main(modes=args.mode or tuple(MODES), paths=args.path or DEFAULT_PATHS,
+         concurrency=args.concurrency, rounds=args.rounds)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Compact binary export of the grid and Sankey outputs.
+
+Layout (all integers little-endian):
+    0   magic b'TSCS'
+    4   uint32 length H of the header
+    8   header JSON (UTF-8, space-padded to a multiple of 4 bytes)
+    8+H packed count arrays, each 4-byte aligned at header['arrays'][name]['offset']
+
+Every label (class, age group, region) lives once in header['strings'];
+dimensions refer to it by index, and counts are dense arrays stored with the
+smallest unsigned integer type that fits.
+"""
+
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'TSCS'
+FORMAT_VERSION = 1
+
+
+def smallest_uint_dtype(max_value):
+    """Smallest unsigned dtype able to hold max_value"""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+def add_strings(strings, values):
+    """Add values to the shared string table (once each) and return their indexes"""
+    indexes = []
+    for value in values:
+        if value not in strings:
+            strings.append(value)
+        indexes.append(strings.index(value))
+    return indexes
+
+
+def pack(header, arrays):
+    """Serialize a header dict and named count arrays to bytes"""
+    header = dict(header, format=FORMAT_VERSION, arrays={})
+    body = bytearray()
+    for name, values in arrays.items():
+        values = np.ascontiguousarray(values)
+        dtype = smallest_uint_dtype(int(values.max()) if values.size else 0)
+        body.extend(b'\0' * (-len(body) % 4))
+        header['arrays'][name] = {'dtype': dtype.name, 'shape': list(values.shape), 'offset': len(body)}
+        body.extend(values.astype(dtype.newbyteorder('<')).tobytes())
+
+    encoded = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    encoded += b' ' * (-len(encoded) % 4)
+    return MAGIC + struct.pack('<I', len(encoded)) + encoded + bytes(body)
+
+
+def unpack(data):
+    """Inverse of pack: returns (header, {name: ndarray})"""
+    if data[:4] != MAGIC:
+        raise ValueError('not a compact TSCS file')
+    (header_length,) = struct.unpack('<I', data[4:8])
+    header = json.loads(data[8:8 + header_length].decode('utf-8'))
+    body = memoryview(data)[8 + header_length:]
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype']).newbyteorder('<')
+        count = int(np.prod(spec['shape']))
+        arrays[name] = np.frombuffer(body, dtype=dtype, count=count,
+                                     offset=spec['offset']).reshape(spec['shape'])
+    return header, arrays
+
+
+def encode_grid_counts(counts, year, zip_to_region, age_labels, subjective_classes, objective_classes):
+    """Compact form of a grid_viz_data file from grid count cubes"""
+    strings = []
+    header = {
+        'kind': 'grid',
+        'year': year,
+        'total_samples': counts['total_samples'],
+        'dims': {
+            'zip': [int(z) for z in counts['zip_codes']],
+            'region': add_strings(strings, [zip_to_region.get(int(z), '未知地區')
+                                            for z in counts['zip_codes']]),
+            'age': add_strings(strings, age_labels),
+            'subjective': add_strings(strings, subjective_classes),
+            'objective': add_strings(strings, objective_classes)
+        }
+    }
+    header['strings'] = strings
+    return pack(header, {'subjective': counts['subjective'], 'objective': counts['objective']})
+
+
+def encode_sankey_matrix(matrix, year, subjective_classes, objective_classes):
+    """Compact form of a wealth_data file from its contingency table"""
+    strings = []
+    header = {
+        'kind': 'sankey',
+        'year': year,
+        'total_samples': int(matrix.sum()),
+        'dims': {
+            'subjective': add_strings(strings, subjective_classes),
+            'objective': add_strings(strings, objective_classes)
+        }
+    }
+    header['strings'] = strings
+    return pack(header, {'flows': matrix})
@@ -9,10 +9,10 @@
 function initializeComparisonChart() {
     console.log('Initializing comparison chart...');
 
-    // Load comparison data
-    d3.json('data/processed/comparison_data.json')
-        .then(data => {
-            renderComparisonChart(data);
+    // Load comparison data from the all-years cube (shared with the heatmap)
+    loadDataJson('data/processed/wealth_cube.json')
+        .then(cube => {
+            renderComparisonChart(cube.comparison);
         })
         .catch(error => {
             console.error('Error loading comparison data:', error);
@@ -113,8 +113,8 @@ function initializeMap() {
 
     // Load TopoJSON data (already simplified)
     Promise.all([
-        d3.json('map/Taiwan_COUNTY_topo.json'),
-        d3.json('map/Taiwan_TOWN_topo.json')
+        loadDataJson('map/Taiwan_COUNTY_topo.json'),
+        loadDataJson('map/Taiwan_TOWN_topo.json')
     ]).then(([countyTopo, townTopo]) => {
         // Convert TopoJSON to GeoJSON
         // TopoJSON files should have a specific structure - let's check the object keys
@@ -634,6 +634,40 @@ function toggleGrid() {
     }
 }
 
+/**
+ * Rebuild grid_viz_data JSON structure from its compact binary form
+ * @param {Object} compact - { header, arrays } from parseCompactData
+ * @returns {Object} Grid data keyed by ZIP code
+ */
+function decodeCompactGrid({ header, arrays }) {
+    const { strings, dims } = header;
+    const ages = dims.age.map(i => strings[i]);
+    const data = { year: header.year, total_samples: header.total_samples, zip_codes: {} };
+
+    dims.zip.forEach((zip, zipIndex) => {
+        const zipData = { zip: String(zip), region: strings[dims.region[zipIndex]], subjective: {}, objective: {} };
+
+        ['subjective', 'objective'].forEach(kind => {
+            const classes = dims[kind].map(i => strings[i]);
+            const counts = arrays[kind];
+            ages.forEach((age, ageIndex) => {
+                const base = (zipIndex * ages.length + ageIndex) * classes.length;
+                classes.forEach((wealthClass, classIndex) => {
+                    const count = counts[base + classIndex];
+                    if (count > 0) {
+                        if (!zipData[kind][age]) zipData[kind][age] = {};
+                        zipData[kind][age][wealthClass] = count;
+                    }
+                });
+            });
+        });
+
+        data.zip_codes[String(zip)] = zipData;
+    });
+
+    return data;
+}
+
 /**
  * Load map data for a specific year
  * @param {string} year - Year to load data for
@@ -642,8 +676,8 @@ function loadMapData(year) {
     console.log(`Loading map data for year ${year}...`);
     currentYear = year;
 
-    // Load grid visualization data
-    d3.json(`data/processed/grid_viz_data_${year}.json`).then(data => {
+    // Load grid visualization data (compact binary when available)
+    loadCompactOrJson(`data/processed/grid_viz_data_${year}`, decodeCompactGrid).then(data => {
         gridVizData = data;
         console.log(`Loaded grid data for ${year}:`, data.total_samples, 'samples,', Object.keys(data.zip_codes).length, 'ZIP codes');
 
@@ -25,16 +25,6 @@ const OBJECTIVE_CATEGORIES = ['低', '中低', '中等', '中高', '高'];
 // Survey years (X-axis)
 const YEARS = [1992, 1997, 2002, 2007, 2012, 2017, 2022];
 
-// Mapping from subjective class names to numeric scores (1-6)
-const SUBJECTIVE_TO_SCORE = {
-    '下層階級': 1,
-    '勞工階級': 2,
-    '中下層階級': 3,
-    '中層階級': 4,
-    '中上層階級': 5,
-    '上層階級': 6
-};
-
 // Mapping from objective wealth categories to numeric scores (1-5)
 const OBJECTIVE_TO_SCORE = {
     '低': 1,
@@ -63,31 +53,15 @@ function initializeHeatmap() {
     container.innerHTML = '<p style="text-align: center; padding: 40px; color: #7f8c8d;">載入中...</p>';
     console.log('[HEATMAP] Loading message displayed');
 
-    // Load all year data
-    const dataPromises = YEARS.map(year => {
-        const path = `data/processed/wealth_data_${year}.json`;
-        console.log(`[HEATMAP] Loading data from: ${path}`);
-
-        return d3.json(path)
-            .then(data => {
-                console.log(`[HEATMAP] Successfully loaded ${year}:`, data);
-                return { year, data };
-            })
-            .catch(error => {
-                console.error(`[HEATMAP] Error loading data for ${year}:`, error);
-                return { year, data: null };
-            });
-    });
+    // Load the all-years cube: heatmap cells are precomputed by the pipeline
+    const path = 'data/processed/wealth_cube.json';
+    console.log(`[HEATMAP] Loading data from: ${path}`);
 
-    console.log('[HEATMAP] Waiting for all data promises...');
-
-    Promise.all(dataPromises)
-        .then(yearDataArray => {
-            console.log('[HEATMAP] All data loaded:', yearDataArray);
-
-            // Process data and create heatmap
-            const heatmapData = processHeatmapData(yearDataArray);
-            console.log('[HEATMAP] Processed heatmap data:', heatmapData);
+    loadDataJson(path)
+        .then(cube => {
+            console.log('[HEATMAP] Cube loaded:', cube);
+            const heatmapData = cube.heatmap;
+            console.log(`[HEATMAP] Total heatmap cells: ${heatmapData.length}`);
 
             renderHeatmap(container, heatmapData);
         })
@@ -97,106 +71,6 @@ function initializeHeatmap() {
         });
 }
 
-/**
- * Process loaded data into heatmap format
- * @param {Array} yearDataArray - Array of {year, data} objects
- * @returns {Array} Heatmap data with format [{year, objective, subjective_avg, count}, ...]
- */
-function processHeatmapData(yearDataArray) {
-    console.log('[HEATMAP] Processing data...');
-    const heatmapData = [];
-
-    yearDataArray.forEach(({ year, data }) => {
-        console.log(`[HEATMAP] Processing year ${year}:`, data);
-
-        if (!data) {
-            console.warn(`[HEATMAP] No data object for year ${year}`);
-            return;
-        }
-
-        if (!data.links) {
-            console.warn(`[HEATMAP] No links in data for year ${year}. Available keys:`, Object.keys(data));
-            return;
-        }
-
-        console.log(`[HEATMAP] ${year} has ${data.links.length} links`);
-
-        // Group links by objective wealth and accumulate weighted subjective scores
-        const objectiveGroups = {};
-        OBJECTIVE_CATEGORIES.forEach(cat => {
-            objectiveGroups[cat] = {
-                totalScore: 0,
-                totalCount: 0
-            };
-        });
-
-        data.links.forEach((link, idx) => {
-            if (idx < 3) {
-                console.log(`[HEATMAP] Sample link ${idx} for ${year}:`, link);
-            }
-
-            const objective = link.target; // target is the objective wealth
-            const subjective = link.source; // source is the subjective class
-            const count = link.value; // number of samples
-
-            if (objective && subjective && count > 0) {
-                if (objectiveGroups[objective]) {
-                    const score = SUBJECTIVE_TO_SCORE[subjective];
-                    if (score) {
-                        // Accumulate weighted scores
-                        objectiveGroups[objective].totalScore += score * count;
-                        objectiveGroups[objective].totalCount += count;
-                    } else {
-                        if (idx < 3) console.warn(`[HEATMAP] Unknown subjective class: ${subjective}`);
-                    }
-                } else {
-                    if (idx < 3) console.warn(`[HEATMAP] Unknown objective category: ${objective}`);
-                }
-            }
-        });
-
-        console.log(`[HEATMAP] ${year} objective groups:`, Object.keys(objectiveGroups).map(k => `${k}: ${objectiveGroups[k].totalCount} samples`));
-
-        // Calculate average subjective score and perception gap for each objective category
-        OBJECTIVE_CATEGORIES.forEach(objective => {
-            const group = objectiveGroups[objective];
-            if (group.totalCount > 0) {
-                const subjectiveAvg = group.totalScore / group.totalCount;
-
-                // Calculate perception gap (absolute difference between subjective and objective)
-                // Normalize both to comparable scales:
-                // Subjective: 1-6 scale → normalize to 1-5 scale by mapping (x-1)*5/5+1 = x
-                // We need to map subjective 1-6 to comparable objective 1-5
-                const normalizedSubjective = (subjectiveAvg - 1) * (4 / 5) + 1; // Map 1-6 to 1-5
-                const objectiveScore = OBJECTIVE_TO_SCORE[objective];
-                const perceptionGap = Math.abs(normalizedSubjective - objectiveScore);
-
-                heatmapData.push({
-                    year: year,
-                    objective: objective,
-                    subjective_avg: subjectiveAvg,
-                    perception_gap: perceptionGap,
-                    count: group.totalCount
-                });
-                console.log(`[HEATMAP] ${year} - ${objective}: subjective_avg=${subjectiveAvg.toFixed(2)}, perception_gap=${perceptionGap.toFixed(2)}, count=${group.totalCount}`);
-            } else {
-                // No data for this cell
-                heatmapData.push({
-                    year: year,
-                    objective: objective,
-                    subjective_avg: null,
-                    perception_gap: null,
-                    count: 0
-                });
-                console.log(`[HEATMAP] ${year} - ${objective}: NO DATA`);
-            }
-        });
-    });
-
-    console.log(`[HEATMAP] Total heatmap cells: ${heatmapData.length}`);
-    return heatmapData;
-}
-
 /**
  * Render the heatmap visualization
  * @param {HTMLElement} container - Container element
@@ -260,9 +260,96 @@ function hideTooltip() {
     }
 }
 
+/**
+ * Parse a compact binary data file written by prepare_all_data.py --compact
+ * (layout documented in compact_format.py)
+ * @param {ArrayBuffer} buffer - File contents
+ * @returns {Object} { header, arrays } where arrays are typed array views
+ */
+function parseCompactData(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== 'TSCS') {
+        throw new Error('Not a compact TSCS data file');
+    }
+
+    const headerLength = view.getUint32(4, true);
+    const header = JSON.parse(new TextDecoder('utf-8').decode(new Uint8Array(buffer, 8, headerLength)));
+    const bodyStart = 8 + headerLength;
+
+    const typedArrays = { uint8: Uint8Array, uint16: Uint16Array, uint32: Uint32Array };
+    const arrays = {};
+    for (const [name, spec] of Object.entries(header.arrays)) {
+        const length = spec.shape.reduce((a, b) => a * b, 1);
+        arrays[name] = new typedArrays[spec.dtype](buffer, bodyStart + spec.offset, length);
+    }
+
+    return { header, arrays };
+}
+
+let manifestPromise = null;
+
+/**
+ * Load data/manifest.json (written by output_manifest.py) once
+ * @returns {Promise<Object|null>} Logical path -> { file, size, records, sha256 }; null if there is no manifest
+ */
+function loadManifest() {
+    if (!manifestPromise) {
+        // The manifest itself is always revalidated; the hashed files it points to never change
+        manifestPromise = d3.json('data/manifest.json', { cache: 'no-cache' })
+            .then(manifest => manifest.files)
+            .catch(() => null);
+    }
+    return manifestPromise;
+}
+
+/**
+ * Resolve a logical data path to its content-hashed file, or itself if it is not in the manifest
+ * @param {string} path - Logical path (e.g. data/processed/grid_viz_data_2022.json)
+ * @returns {Promise<string>} Path to fetch
+ */
+function resolveDataPath(path) {
+    return loadManifest().then(files => files && files[path] ? files[path].file : path);
+}
+
+/**
+ * Load a JSON data file through the manifest
+ * @param {string} path - Logical path
+ * @returns {Promise<Object>} Parsed JSON
+ */
+function loadDataJson(path) {
+    return resolveDataPath(path).then(url => d3.json(url));
+}
+
+/**
+ * Load a data file, preferring its compact binary form and falling back to JSON
+ * The manifest lists every built file, so the .bin is only requested when the
+ * manifest has it (or when there is no manifest)
+ * @param {string} basePath - Path without extension (e.g. data/processed/grid_viz_data_2022)
+ * @param {Function} decode - Converts { header, arrays } to the JSON structure
+ * @returns {Promise<Object>} Data in the JSON structure
+ */
+function loadCompactOrJson(basePath, decode) {
+    const compactPath = `${basePath}.bin`;
+    const jsonPath = `${basePath}.json`;
+    return loadManifest().then(files => {
+        if (files && !files[compactPath]) {
+            return loadDataJson(jsonPath);
+        }
+        return resolveDataPath(compactPath)
+            .then(url => d3.buffer(url))
+            .then(buffer => decode(parseCompactData(buffer)))
+            .catch(() => loadDataJson(jsonPath));
+    });
+}
+
 // Export functions for use in other modules
 window.showPanel = showPanel;
 window.formatNumber = formatNumber;
 window.calculatePercentage = calculatePercentage;
 window.showTooltip = showTooltip;
 window.hideTooltip = hideTooltip;
+window.parseCompactData = parseCompactData;
+window.loadCompactOrJson = loadCompactOrJson;
+window.resolveDataPath = resolveDataPath;
+window.loadDataJson = loadDataJson;
@@ -202,8 +202,8 @@ function loadAnimatedSankeyDiagram(year) {
     // Show loading message
     container.innerHTML = '<p style="text-align: center; padding: 20px; color: #7f8c8d;">載入中...</p>';
 
-    // Load data
-    d3.json(`data/processed/wealth_data_${year}.json`)
+    // Load data (compact binary when available)
+    loadCompactOrJson(`data/processed/wealth_data_${year}`, decodeCompactSankey)
         .then(data => {
             renderAnimatedSankeyDiagram(container, data, year);
         })
@@ -213,6 +213,42 @@ function loadAnimatedSankeyDiagram(year) {
         });
 }
 
+/**
+ * Rebuild wealth_data JSON structure from its compact binary form
+ * @param {Object} compact - { header, arrays } from parseCompactData
+ * @returns {Object} Wealth data with nodes, links and summary
+ */
+function decodeCompactSankey({ header, arrays }) {
+    const subjectiveClasses = header.dims.subjective.map(i => header.strings[i]);
+    const objectiveClasses = header.dims.objective.map(i => header.strings[i]);
+    const flows = arrays.flows;
+
+    const links = [];
+    const bySubjective = {};
+    const byObjective = {};
+    subjectiveClasses.forEach((source, s) => {
+        objectiveClasses.forEach((target, o) => {
+            const value = flows[s * objectiveClasses.length + o];
+            if (value > 0) {
+                links.push({ source, target, value });
+                bySubjective[source] = (bySubjective[source] || 0) + value;
+                byObjective[target] = (byObjective[target] || 0) + value;
+            }
+        });
+    });
+
+    return {
+        year: header.year,
+        total_samples: header.total_samples,
+        nodes: {
+            subjective: subjectiveClasses.filter(c => c in bySubjective),
+            objective: objectiveClasses.filter(c => c in byObjective)
+        },
+        links,
+        summary: { by_subjective: bySubjective, by_objective: byObjective }
+    };
+}
+
 /**
  * Render animated Sankey diagram in the specified container
  * @param {HTMLElement} container - Container element
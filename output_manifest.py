@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Content-addressed copies of the served files and the manifest mapping to them.
+Each output is copied to data/hashed/<name>.<hash>.<ext>; data/manifest.json
+maps logical paths (e.g. data/processed/grid_viz_data_2022.json) to the hashed
+file, its size and record count. Unchanged files keep their hashed name across
+rebuilds, so browsers can cache them forever.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import compact_format
+import static_compression
+
+MANIFEST_FILE = Path('./data/manifest.json')
+HASHED_PATH = Path('./data/hashed')
+
+# Hex digits of the SHA-256 kept in hashed filenames
+HASH_LENGTH = 12
+
+MANIFEST_VERSION = 1
+
+
+def hashed_name(file_path, sha256):
+    """name.<hash>.ext for a file with the given content hash"""
+    file_path = Path(file_path)
+    return f'{file_path.stem}.{sha256[:HASH_LENGTH]}{file_path.suffix}'
+
+
+def record_count(file_path, data):
+    """Records described by an output file (respondents, years or map features)"""
+    if file_path.suffix == '.bin':
+        header, _ = compact_format.unpack(data)
+        return header['total_samples']
+
+    content = json.loads(data)
+    if 'total_samples' in content:
+        return content['total_samples']
+    if 'years' in content:
+        return len(content['years'])
+    if content.get('type') == 'Topology':
+        return sum(len(obj.get('geometries', [])) for obj in content['objects'].values())
+    return None
+
+
+def write_hashed_copy(file_path, data, target):
+    """Copy a file to its hashed name (with compressed siblings) unless it is already there"""
+    if target.exists() and target.stat().st_size == len(data):
+        if not static_compression.is_compressed_current(target):
+            static_compression.write_compressed_siblings(target)
+        return False
+
+    tmp_target = target.with_name(f'.{target.name}.{os.getpid()}.tmp')
+    tmp_target.write_bytes(data)
+    tmp_target.replace(target)
+    static_compression.write_compressed_siblings(target)
+    return True
+
+
+def prune_hashed_files(keep, hashed_path=HASHED_PATH):
+    """Remove hashed copies (and their siblings) that the manifest no longer refers to"""
+    keep = {Path(name).name for name in keep}
+    removed = 0
+    for file_path in hashed_path.iterdir():
+        base_name = file_path.name
+        for suffix in static_compression.ENCODING_SUFFIXES.values():
+            base_name = base_name.removesuffix(suffix)
+        if base_name not in keep:
+            file_path.unlink()
+            removed += 1
+    return removed
+
+
+def write_manifest(assets=static_compression.STATIC_ASSETS, manifest_file=MANIFEST_FILE,
+                   hashed_path=HASHED_PATH):
+    """
+    Copy every served asset to its content-addressed name, write the manifest
+    and prune hashed copies of older builds. Returns the manifest.
+    """
+    hashed_path.mkdir(parents=True, exist_ok=True)
+
+    files = {}
+    written = 0
+    for file_path in static_compression.asset_files(assets):
+        data = file_path.read_bytes()
+        sha256 = hashlib.sha256(data).hexdigest()
+        target = hashed_path / hashed_name(file_path, sha256)
+        written += write_hashed_copy(file_path, data, target)
+        files[file_path.as_posix()] = {
+            'file': target.as_posix(),
+            'size': len(data),
+            'records': record_count(file_path, data),
+            'sha256': sha256
+        }
+
+    manifest = {'version': MANIFEST_VERSION, 'files': files}
+    with open(manifest_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    static_compression.write_compressed_siblings(manifest_file)
+
+    removed = prune_hashed_files([entry['file'] for entry in files.values()], hashed_path)
+    print(f"✓ Saved manifest: {manifest_file} ({len(files)} files, {written} new, {removed} pruned)")
+    return manifest
+
+
+if __name__ == '__main__':
+    write_manifest()
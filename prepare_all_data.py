@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Prepare all visualization data in one pass
+Loads each TSCS wave once and writes the Sankey, comparison and grid outputs
+from a single respondent table
+"""
+
+import hashlib
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, reduce
+from pathlib import Path
+
+import numpy as np
+
+import compact_format
+import output_manifest
+import prepare_grid_visualization_data as grid_module
+import run_report
+import static_compression
+import survey_cube
+import wave_cache
+
+pwd_module = grid_module.pwd_module
+
+OUTPUT_PATH = pwd_module.OUTPUT_PATH
+
+# Per-wave fingerprints and aggregates from the last build
+BUILD_STATE_FILE = Path('./data/build_state.json')
+
+# Source files whose changes invalidate every wave
+PIPELINE_SOURCES = [Path(pwd_module.__file__), Path(grid_module.__file__),
+                    Path(__file__), Path(wave_cache.__file__), Path(compact_format.__file__),
+                    Path(static_compression.__file__), Path(survey_cube.__file__)]
+
+# Labels of the survey cube dimensions after zip
+SURVEY_LABELS = {
+    'age': survey_cube.with_unknown(grid_module.AGE_LABELS),
+    'gender': survey_cube.with_unknown(survey_cube.GENDER_CODES.values()),
+    'subjective': survey_cube.with_unknown(pwd_module.SUBJECTIVE_CLASSES),
+    'objective': survey_cube.with_unknown(pwd_module.OBJECTIVE_CLASSES),
+    'sample': survey_cube.SAMPLE_LABELS
+}
+SURVEY_SHAPE = tuple(len(labels) for labels in SURVEY_LABELS.values())
+
+
+def hash_file(file_path):
+    """SHA-256 of a file's content"""
+    return hashlib.sha256(Path(file_path).read_bytes()).hexdigest()
+
+
+def wave_fingerprint(year):
+    """
+    Fingerprint everything a wave's outputs depend on: the input file, its
+    config slice, the code tables and the pipeline scripts themselves.
+    Returns None when the input file is missing.
+    """
+    try:
+        input_file = wave_cache.file_fingerprint(pwd_module.DATA_PATH / pwd_module.FILE_MAPPING[year])
+    except OSError:
+        return None
+
+    payload = {
+        'input': {'size': input_file['size'], 'sha256': input_file['sha256']},
+        'config': pwd_module.VAR_CONFIG[year],
+        'age': pwd_module.AGE_CONFIG[year],
+        'income_codes': pwd_module.INCOME_CODE_RANGES.get(year),
+        'thresholds': pwd_module.INCOME_THRESHOLDS[year],
+        'classes': [pwd_module.SUBJECTIVE_CLASSES, pwd_module.OBJECTIVE_CLASSES,
+                    pwd_module.MISSING_LABEL_MARKERS],
+        'age_groups': [grid_module.AGE_BINS, grid_module.AGE_LABELS],
+        'scripts': [hash_file(path) for path in PIPELINE_SOURCES]
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def wave_output_files(year, compact=False):
+    """Output files written for one wave (JSON, plus the compact binaries if requested)"""
+    files = [OUTPUT_PATH / f'wealth_data_{year}.json', OUTPUT_PATH / f'grid_viz_data_{year}.json']
+    if compact:
+        files += [OUTPUT_PATH / f'wealth_data_{year}.bin', OUTPUT_PATH / f'grid_viz_data_{year}.bin']
+    return files
+
+
+def load_build_state():
+    """Load the previous build state ({year: entry}), empty if none"""
+    try:
+        with open(BUILD_STATE_FILE, encoding='utf-8') as f:
+            return {int(year): entry for year, entry in json.load(f).items()}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_build_state(state):
+    """Persist the build state"""
+    BUILD_STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    pwd_module.save_json({str(year): entry for year, entry in sorted(state.items())}, BUILD_STATE_FILE,
+                         precompress=False)
+
+
+def is_up_to_date(year, fingerprint, state, compact=False, cube=None):
+    """True when a wave's inputs match the last build and its outputs (and cube slice) exist"""
+    entry = state.get(year)
+    return (fingerprint is not None and entry is not None and
+            entry['fingerprint'] == fingerprint and
+            all(path.exists() for path in wave_output_files(year, compact)) and
+            cube is not None and year in cube['dims']['year'])
+
+
+def with_unknown_codes(codes, n_labels):
+    """Map missing (-1) category codes to the unknown slot after n_labels"""
+    codes = np.asarray(codes, dtype=np.int64)
+    return np.where(codes < 0, n_labels, codes)
+
+
+def survey_counts_from_table(table):
+    """Count a grid respondent table into the survey cube's zip × age × gender × class × sample cells"""
+    zip_code = table['zip_code']
+    zip_labels = np.where(zip_code.notna(),
+                          np.trunc(zip_code.fillna(0).to_numpy()).astype(np.int64).astype(str),
+                          survey_cube.UNKNOWN_LABEL)
+    codes = (
+        with_unknown_codes(table['age_group'].cat.codes, len(grid_module.AGE_LABELS)),
+        survey_cube.gender_codes(table['gender']),
+        with_unknown_codes(pwd_module.encode_classes(table['subjective_class'], pwd_module.SUBJECTIVE_CLASSES),
+                           len(pwd_module.SUBJECTIVE_CLASSES)),
+        with_unknown_codes(pwd_module.encode_classes(table['objective_class'], pwd_module.OBJECTIVE_CLASSES),
+                           len(pwd_module.OBJECTIVE_CLASSES)),
+        table['excluded'].to_numpy().astype(np.int64)
+    )
+    return survey_cube.count_respondents(zip_labels, codes, SURVEY_SHAPE)
+
+
+def empty_wave_aggregates():
+    """Aggregates of a wave with no respondents"""
+    return {'wealth': pwd_module.empty_wealth_aggregates(), 'grid': grid_module.empty_grid_counts(),
+            'survey': survey_cube.empty_wave_counts(SURVEY_SHAPE)}
+
+
+def aggregate_wave_table(table):
+    """Reduce (a chunk of) a grid respondent table to mergeable aggregates"""
+    return {
+        'wealth': pwd_module.wealth_aggregates_from_table(table),
+        'grid': grid_module.aggregate_grid_counts(table),
+        'survey': survey_counts_from_table(table)
+    }
+
+
+def merge_wave_aggregates(a, b):
+    """Combine the aggregates of two chunks of a wave"""
+    return {
+        'wealth': pwd_module.merge_wealth_aggregates(a['wealth'], b['wealth']),
+        'grid': grid_module.merge_grid_counts(a['grid'], b['grid']),
+        'survey': survey_cube.merge_wave_counts(a['survey'], b['survey'])
+    }
+
+
+def outputs_from_aggregates(aggregates, year, meta, compact=False, report=None):
+    """Build the Sankey, score and grid outputs of a wave from its aggregates"""
+    wealth = aggregates['wealth']
+    grid = aggregates['grid']
+
+    pwd_module.print_statistics(wealth['total'], wealth['valid'], wealth['excluded'],
+                                wealth['missing_subjective'], wealth['missing_objective'])
+    print(f"  Grid records: {grid['total_samples']} / {wealth['total']}")
+
+    zip_var = pwd_module.VAR_CONFIG[year]['zip']
+    zip_to_region = meta.variable_value_labels.get(zip_var, {})
+
+    with run_report.stage(report, 'aggregate'):
+        outputs = {
+            'records': wealth['valid'],
+            'sankey_matrix': wealth['sankey'],
+            'sankey': pwd_module.sankey_data_from_matrix(wealth['sankey'], year),
+            'scores': pwd_module.score_state_results(wealth['scores']),
+            'grid': grid_module.grid_data_from_counts(grid, year, zip_to_region),
+            'survey': aggregates['survey'],
+            'survey_regions': {z: zip_to_region.get(int(z), survey_cube.UNKNOWN_LABEL)
+                               for z in aggregates['survey']['zip'] if z.isdigit()}
+        }
+    if compact:
+        with run_report.stage(report, 'serialize'):
+            outputs['sankey_compact'] = compact_format.encode_sankey_matrix(
+                wealth['sankey'], year, pwd_module.SUBJECTIVE_CLASSES, pwd_module.OBJECTIVE_CLASSES)
+            outputs['grid_compact'] = compact_format.encode_grid_counts(
+                grid, year, zip_to_region, grid_module.AGE_LABELS,
+                pwd_module.SUBJECTIVE_CLASSES, pwd_module.OBJECTIVE_CLASSES)
+    return outputs
+
+
+def aggregate_chunks(chunks, year, report=None):
+    """
+    Classify and aggregate a sequence of (df, meta) chunks of one wave.
+    Reading each chunk (streamed .sav files decode lazily) counts as 'load'.
+    """
+    aggregates = empty_wave_aggregates()
+    meta = None
+    chunks = iter(chunks)
+    while True:
+        with run_report.stage(report, 'load'):
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        df, meta = chunk
+        run_report.add_rows(report, len(df))
+        table = grid_module.build_grid_table(df, year, meta, report)
+        with run_report.stage(report, 'aggregate'):
+            aggregates = merge_wave_aggregates(aggregates, aggregate_wave_table(table))
+    return aggregates, meta
+
+
+def aggregate_row_range(year, row_offset, row_limit, chunksize=None):
+    """
+    Decode and aggregate one row range of a wave.
+    Runs in a worker process and returns only the compact aggregates and
+    the stage timings of the range.
+    """
+    report = run_report.new_wave_report()
+    if chunksize:
+        chunks = pwd_module.iter_data_chunks(year, chunksize, row_offset=row_offset, row_limit=row_limit)
+    else:
+        with run_report.stage(report, 'load'):
+            chunks = [pwd_module.load_data_rows(year, row_offset, row_limit)]
+    aggregates, _ = aggregate_chunks(chunks, year, report)
+    return aggregates, report
+
+
+def split_rows(number_rows, parts):
+    """Split range(number_rows) into at most `parts` contiguous (offset, limit) ranges"""
+    bounds = np.linspace(0, number_rows, min(parts, number_rows) + 1).astype(int)
+    return [(int(start), int(stop - start)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def process_wave(year, use_cache=True, chunksize=None, row_workers=1, compact=False, report=None):
+    """
+    Load one wave and derive every output from one respondent table.
+    With chunksize, the wave is streamed and only chunk aggregates are kept;
+    with row_workers > 1, row ranges are decoded in parallel processes (their
+    stage times are summed into report, so they can exceed the wall time).
+    """
+    print(f"\n{'=' * 60}")
+    print(f"Processing {year}")
+    print(f"{'=' * 60}")
+
+    meta = pwd_module.load_metadata(year) if row_workers > 1 else None
+
+    if meta is not None and meta.number_rows:
+        row_ranges = split_rows(meta.number_rows, row_workers)
+        with ProcessPoolExecutor(max_workers=len(row_ranges)) as executor:
+            futures = [executor.submit(aggregate_row_range, year, offset, limit, chunksize)
+                       for offset, limit in row_ranges]
+            results = [f.result() for f in futures]
+        # Merge in row order so ZIP codes keep their first-appearance order
+        with run_report.stage(report, 'aggregate'):
+            aggregates = reduce(merge_wave_aggregates, (result[0] for result in results),
+                                empty_wave_aggregates())
+        if report is not None:
+            report.update(reduce(run_report.merge_wave_reports, (result[1] for result in results), report))
+    elif chunksize:
+        aggregates, meta = aggregate_chunks(pwd_module.iter_data_chunks(year, chunksize), year, report)
+    else:
+        with run_report.stage(report, 'load'):
+            wave = pwd_module.load_data(year, use_cache=use_cache)
+        aggregates, meta = aggregate_chunks([wave], year, report)
+
+    return outputs_from_aggregates(aggregates, year, meta, compact, report)
+
+
+def main(workers=1, use_cache=True, force=False, chunksize=None, row_workers=1, compact=False):
+    started = time.time()
+    print("=" * 60)
+    print("Taiwan Social Change Survey - All Visualization Data")
+    print("=" * 60)
+
+    state = load_build_state()
+    cube = survey_cube.load_survey_cube()
+    fingerprints = {year: wave_fingerprint(year) for year in pwd_module.YEARS}
+    stale_years = [year for year in pwd_module.YEARS
+                   if force or not is_up_to_date(year, fingerprints[year], state, compact, cube)]
+
+    # Unchanged waves keep their slice of the previous survey cube
+    survey_by_year = {}
+    for year in pwd_module.YEARS:
+        if year not in stale_years:
+            survey_by_year[year] = survey_cube.wave_counts_from_cube(cube, year)
+
+    for year in pwd_module.YEARS:
+        if year not in stale_years:
+            print(f"  = {year} unchanged, skipping")
+        # Failed waves drop out of comparison_data.json, as in the other scripts
+        elif year in state:
+            del state[year]
+
+    wave_reports = {}
+    all_years = run_report.new_wave_report()
+
+    process = partial(run_report.timed_wave, process_wave, use_cache=use_cache, chunksize=chunksize,
+                      row_workers=row_workers, compact=compact)
+    for year, (result, report) in pwd_module.run_waves(process, stale_years, workers):
+        wave_reports[year] = report
+        sankey_file, grid_file = wave_output_files(year)[:2]
+
+        with run_report.stage(report, 'serialize'):
+            pwd_module.save_json(result['sankey'], sankey_file)
+            print(f"  ✓ Saved: {sankey_file}")
+
+            pwd_module.save_json(result['grid'], grid_file)
+            print(f"  ✓ Saved: {grid_file}")
+
+            if compact:
+                for key, compact_file in zip(('sankey_compact', 'grid_compact'),
+                                             wave_output_files(year, compact)[2:]):
+                    compact_file.write_bytes(result[key])
+                    static_compression.write_compressed_siblings(compact_file)
+                    print(f"  ✓ Saved: {compact_file} ({len(result[key]):,} bytes)")
+            else:
+                pwd_module.remove_compact_sibling(sankey_file)
+                pwd_module.remove_compact_sibling(grid_file)
+
+        survey_by_year[year] = (result['survey'], result['survey_regions'])
+
+        grid = result['grid']
+        state[year] = {
+            'fingerprint': fingerprints[year],
+            'records': result['records'],
+            'grid_samples': grid['total_samples'],
+            'zip_codes': len(grid['zip_codes']),
+            'sankey_matrix': result['sankey_matrix'].tolist(),
+            'scores': {key: None if value is None else float(value)
+                       for key, value in result['scores'].items()}
+        }
+
+    with run_report.stage(all_years, 'serialize'):
+        save_build_state(state)
+
+    # comparison_data.json and the all-years cube only need the per-wave aggregates
+    comparison_file = OUTPUT_PATH / 'comparison_data.json'
+    cube_file = OUTPUT_PATH / 'wealth_cube.json'
+    if stale_years or not comparison_file.exists() or not cube_file.exists():
+        built_years = [year for year in pwd_module.YEARS if year in state]
+        scores_by_year = {year: state[year]['scores'] for year in built_years}
+        matrices_by_year = {year: state[year]['sankey_matrix'] for year in built_years}
+
+        with run_report.stage(all_years, 'aggregate'):
+            comparison_data = pwd_module.build_comparison_data(scores_by_year)
+            wealth_cube = pwd_module.build_wealth_cube(matrices_by_year, scores_by_year)
+
+        with run_report.stage(all_years, 'serialize'):
+            pwd_module.save_json(comparison_data, comparison_file)
+            print(f"\n✓ Saved comparison data: {comparison_file}")
+
+            pwd_module.save_json(wealth_cube, cube_file)
+            print(f"✓ Saved all-years cube: {cube_file}")
+
+    if stale_years or cube is None:
+        built_years = [year for year in pwd_module.YEARS if year in state and year in survey_by_year]
+        with run_report.stage(all_years, 'aggregate'):
+            cube = survey_cube.build_survey_cube({year: survey_by_year[year][0] for year in built_years},
+                                                 {year: survey_by_year[year][1] for year in built_years},
+                                                 SURVEY_LABELS)
+        with run_report.stage(all_years, 'serialize'):
+            survey_cube.save_survey_cube(cube)
+        print(f"✓ Saved survey cube: {survey_cube.SURVEY_CUBE_FILE} "
+              f"({' × '.join(str(len(labels)) for labels in cube['dims'].values())} cells)")
+
+    with run_report.stage(all_years, 'serialize'):
+        output_manifest.write_manifest()
+
+    pwd_module.write_run_report('prepare_all_data.py', wave_reports, started, all_years['stages'],
+                                {'workers': workers, 'use_cache': use_cache, 'force': force,
+                                 'chunksize': chunksize, 'row_workers': row_workers, 'compact': compact,
+                                 'skipped': [year for year in pwd_module.YEARS if year not in stale_years]},
+                                OUTPUT_PATH)
+
+    print("\n" + "=" * 60)
+    print("Summary")
+    print("=" * 60)
+    for year in pwd_module.YEARS:
+        if year in state:
+            entry = state[year]
+            status = 'rebuilt' if year in stale_years else 'unchanged'
+            print(f"{year}: {entry['records']:,} Sankey records, "
+                  f"{entry['grid_samples']} grid samples, {entry['zip_codes']} ZIP codes ({status})")
+
+    print(f"\nOutput files saved to: {OUTPUT_PATH}")
+
+
+if __name__ == '__main__':
+    args = pwd_module.parse_args('Prepare Sankey, comparison and grid data in one pass.',
+                                 incremental=True, streaming=True)
+    main(workers=args.workers, use_cache=args.use_cache, force=args.force,
+         chunksize=args.chunksize, row_workers=args.row_workers, compact=args.compact)
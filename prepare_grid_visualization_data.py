@@ -6,17 +6,21 @@ Extends prepare_wealth_data.py to add geographic and age information
 
 import sys
 import importlib.util
+import time
 
 # Import functions from prepare_wealth_data.py
 spec = importlib.util.spec_from_file_location("prepare_wealth_data", "prepare_wealth_data.py")
 pwd_module = importlib.util.module_from_spec(spec)
+sys.modules["prepare_wealth_data"] = pwd_module  # lets worker processes unpickle its functions
 spec.loader.exec_module(pwd_module)
 
 import pandas as pd
 import numpy as np
-import json
 from pathlib import Path
-from collections import defaultdict
+from functools import partial
+
+import output_manifest
+import run_report
 
 # Reuse configurations from prepare_wealth_data
 DATA_PATH = pwd_module.DATA_PATH
@@ -25,167 +29,183 @@ FILE_MAPPING = pwd_module.FILE_MAPPING
 VAR_CONFIG = pwd_module.VAR_CONFIG
 SUBJECTIVE_CLASSES = pwd_module.SUBJECTIVE_CLASSES
 OBJECTIVE_CLASSES = pwd_module.OBJECTIVE_CLASSES
+AGE_CONFIG = pwd_module.AGE_CONFIG
 
 # Age bins: 0-14, 15-24, 25-34, 35-44, 45-54, 55-64, 65+
 AGE_BINS = [0, 15, 25, 35, 45, 55, 65, 101]
 AGE_LABELS = ['0-14歲', '15-24歲', '25-34歲', '35-44歲', '45-54歲', '55-64歲', '65歲以上']
 
 
-def calculate_age_2017(row):
-    """Calculate age for 2017 data"""
-    # Try birth year/month first
-    a2y = row.get('a2y')
-    a2m = row.get('a2m')
-
-    if pd.notna(a2y) and a2y > 0:
-        birth_year = int(a2y) + 1911  # ROC year to AD
-        return 2017 - birth_year
-
-    # Fall back to approximate age
-    a2a = row.get('a2a')
-    if pd.notna(a2a) and a2a > 0:
-        return int(a2a)
-
-    return np.nan
-
-
-def calculate_age_2022(row):
-    """Calculate age for 2022 data"""
-    # Try birth year/month first
-    a2y = row.get('a2y')
-    a2m = row.get('a2m')
+def age_column(df, year):
+    """
+    Age of every respondent, driven by AGE_CONFIG: the primary column (a birth
+    year converted from the ROC calendar where configured), else the fallback.
+    Returns a float Series of ages (NaN when unknown).
+    """
+    age_spec = AGE_CONFIG[year]
 
-    if pd.notna(a2y) and a2y > 0:
-        birth_year = int(a2y) + 1911  # ROC year to AD
-        return 2022 - birth_year
+    primary = pwd_module.get_column(df, age_spec['primary'])
+    age = np.trunc(primary)
+    if age_spec['roc_offset']:
+        # ROC birth year → age at survey year
+        age = year - (age + age_spec['roc_offset'])
+    age = age.where(primary > 0)
 
-    # Fall back to approximate age
-    a2r = row.get('a2r')
-    if pd.notna(a2r) and a2r > 0:
-        return int(a2r)
+    if age_spec['fallback']:
+        fallback = pwd_module.get_column(df, age_spec['fallback'])
+        age = age.fillna(np.trunc(fallback).where(fallback > 0))
 
-    return np.nan
+    return age
 
 
-def get_age(row, year):
-    """Get age from row based on year-specific logic"""
-    if year == 2017:
-        return calculate_age_2017(row)
-    elif year == 2022:
-        return calculate_age_2022(row)
-    else:
-        # Most years have 'age' variable
-        age_var = 'age' if year != 2012 else 'v2r_3'
-        age = row.get(age_var)
-        if pd.notna(age) and age > 0:
-            return int(age)
-    return np.nan
-
-
-def process_year_for_grid(year):
-    """Process year data to include age groups and ZIP codes"""
-    print(f"\n{'=' * 60}")
-    print(f"Processing {year} for grid visualization")
-    print(f"{'=' * 60}")
-
-    # Load data using existing function
-    df, meta = pwd_module.load_data(year)
-    config = VAR_CONFIG[year]
+def build_grid_table(df, year, meta, report=None):
+    """Respondent table for one wave, extended with age and age group"""
+    table = pwd_module.build_respondent_table(df, year, meta, report)
 
     # Get age
-    df['age'] = df.apply(lambda row: get_age(row, year), axis=1)
+    with run_report.stage(report, 'decode'):
+        table['age'] = age_column(df, year)
 
     # Bin age into groups
-    df['age_group'] = pd.cut(df['age'], bins=AGE_BINS, labels=AGE_LABELS, right=False)
+    with run_report.stage(report, 'classify'):
+        table['age_group'] = pd.cut(table['age'], bins=AGE_BINS, labels=AGE_LABELS, right=False)
 
-    # Get ZIP code
-    zip_var = config.get('zip', 'zip')
-    df['zip_code'] = df[zip_var]
+    return table
 
-    # Get subjective wealth class
-    df['subjective_class'] = df.apply(
-        lambda row: pwd_module.get_subjective_class(row, year, meta),
-        axis=1
-    )
 
-    # Get objective wealth class
-    df['annual_income'] = df.apply(
-        lambda row: pwd_module.get_household_income(row, year, config),
-        axis=1
-    )
-    df['objective_class'] = df['annual_income'].apply(
-        lambda x: pwd_module.classify_objective_wealth(x, year)
+def count_cube(zip_index, age_codes, class_codes, n_zip, n_classes):
+    """Count respondents into a dense zip × age group × class cube with one bincount"""
+    shape = (n_zip, len(AGE_LABELS), n_classes)
+    present = class_codes >= 0
+    flat_index = np.ravel_multi_index(
+        (zip_index[present], age_codes[present], class_codes[present]), shape
     )
+    return np.bincount(flat_index, minlength=int(np.prod(shape))).reshape(shape)
+
 
+def aggregate_grid_counts(table):
+    """
+    Aggregate a respondent table into grid count cubes.
+    Returns the valid sample count, the ZIP codes (in first-appearance order)
+    and one zip × age group × class cube each for subjective and objective wealth.
+    """
     # Filter valid records
-    df_valid = df[
-        df['age_group'].notna() &
-        df['zip_code'].notna() &
-        (df['subjective_class'].notna() | df['objective_class'].notna())
-    ].copy()
+    df_valid = table[
+        table['age_group'].notna() &
+        table['zip_code'].notna() &
+        (table['subjective_class'].notna() | table['objective_class'].notna())
+    ]
 
-    print(f"Valid records: {len(df_valid)} / {len(df)} ({len(df_valid)/len(df)*100:.1f}%)")
+    zip_index, zip_codes = pd.factorize(np.trunc(df_valid['zip_code'].to_numpy()).astype(np.int64))
+    age_codes = df_valid['age_group'].cat.codes.to_numpy()
+
+    return {
+        'total_samples': len(df_valid),
+        'zip_codes': zip_codes,
+        'subjective': count_cube(zip_index, age_codes,
+                                 pwd_module.encode_classes(df_valid['subjective_class'], SUBJECTIVE_CLASSES),
+                                 len(zip_codes), len(SUBJECTIVE_CLASSES)),
+        'objective': count_cube(zip_index, age_codes,
+                                pwd_module.encode_classes(df_valid['objective_class'], OBJECTIVE_CLASSES),
+                                len(zip_codes), len(OBJECTIVE_CLASSES))
+    }
 
-    # Get ZIP code to region name mapping from metadata
-    zip_var = config.get('zip', 'zip')
-    zip_to_region = meta.variable_value_labels.get(zip_var, {})
 
-    # Aggregate data by ZIP code, age group, and wealth
-    records_by_zip = defaultdict(lambda: {
-        'region_name': None,
-        'subjective': defaultdict(lambda: defaultdict(int)),
-        'objective': defaultdict(lambda: defaultdict(int))
-    })
+def empty_grid_counts():
+    """Grid counts with no respondents (identity for merge_grid_counts)"""
+    return {
+        'total_samples': 0,
+        'zip_codes': np.array([], dtype=np.int64),
+        'subjective': np.zeros((0, len(AGE_LABELS), len(SUBJECTIVE_CLASSES)), dtype=np.int64),
+        'objective': np.zeros((0, len(AGE_LABELS), len(OBJECTIVE_CLASSES)), dtype=np.int64)
+    }
 
-    for _, row in df_valid.iterrows():
-        zip_code = str(int(row['zip_code']))
-        age_group = row['age_group']
 
-        # Store region name
-        if records_by_zip[zip_code]['region_name'] is None:
-            records_by_zip[zip_code]['region_name'] = zip_to_region.get(int(row['zip_code']), '未知地區')
+def merge_grid_counts(a, b):
+    """Combine grid counts of two chunks, keeping ZIP codes in first-appearance order"""
+    known = set(a['zip_codes'].tolist())
+    zip_codes = np.concatenate([a['zip_codes'],
+                                [z for z in b['zip_codes'].tolist() if z not in known]]).astype(np.int64)
+    position = {z: i for i, z in enumerate(zip_codes.tolist())}
+    b_positions = [position[z] for z in b['zip_codes'].tolist()]
 
-        # Count subjective wealth
-        if pd.notna(row['subjective_class']):
-            subj_class = row['subjective_class']
-            records_by_zip[zip_code]['subjective'][age_group][subj_class] += 1
+    merged = {'total_samples': a['total_samples'] + b['total_samples'], 'zip_codes': zip_codes}
+    for kind in ('subjective', 'objective'):
+        cube = np.zeros((len(zip_codes),) + a[kind].shape[1:], dtype=np.int64)
+        cube[:len(a['zip_codes'])] += a[kind]
+        cube[b_positions] += b[kind]
+        merged[kind] = cube
+    return merged
 
-        # Count objective wealth
-        if pd.notna(row['objective_class']):
-            obj_class = row['objective_class']
-            records_by_zip[zip_code]['objective'][age_group][obj_class] += 1
 
-    # Convert to JSON-friendly format
+def grid_data_from_counts(counts, year, zip_to_region):
+    """Convert grid count cubes to the zip → age group → class JSON structure"""
     output_data = {
         'year': year,
-        'total_samples': len(df_valid),
+        'total_samples': counts['total_samples'],
         'zip_codes': {}
     }
 
-    for zip_code, data in records_by_zip.items():
+    for zip_position, zip_value in enumerate(counts['zip_codes']):
+        zip_code = str(int(zip_value))
         zip_data = {
             'zip': zip_code,
-            'region': data['region_name'],
+            'region': zip_to_region.get(int(zip_value), '未知地區'),
             'subjective': {},
             'objective': {}
         }
 
-        # Convert subjective wealth data
-        for age_group in AGE_LABELS:
-            if age_group in data['subjective']:
-                zip_data['subjective'][age_group] = dict(data['subjective'][age_group])
-
-        # Convert objective wealth data
-        for age_group in AGE_LABELS:
-            if age_group in data['objective']:
-                zip_data['objective'][age_group] = dict(data['objective'][age_group])
+        for kind, classes in (('subjective', SUBJECTIVE_CLASSES), ('objective', OBJECTIVE_CLASSES)):
+            for age_position, age_group in enumerate(AGE_LABELS):
+                class_counts = counts[kind][zip_position, age_position]
+                if class_counts.any():
+                    zip_data[kind][age_group] = {
+                        classes[i]: int(class_counts[i]) for i in np.flatnonzero(class_counts)
+                    }
 
         output_data['zip_codes'][zip_code] = zip_data
 
+    return output_data
+
+
+def build_grid_data(table, year, meta):
+    """Aggregate a respondent table by ZIP code, age group, and wealth class"""
+    config = VAR_CONFIG[year]
+
+    counts = aggregate_grid_counts(table)
+    total = len(table)
+    print(f"Valid records: {counts['total_samples']} / {total} ({counts['total_samples']/total*100:.1f}%)")
+
+    # Get ZIP code to region name mapping from metadata
+    zip_var = config.get('zip', 'zip')
+    zip_to_region = meta.variable_value_labels.get(zip_var, {})
+
+    return grid_data_from_counts(counts, year, zip_to_region)
+
+
+def process_year_for_grid(year, use_cache=True, report=None, precompress=True):
+    """
+    Process year data to include age groups and ZIP codes (stages timed into report).
+    precompress=False skips the .gz/.br siblings (benchmarks).
+    """
+    print(f"\n{'=' * 60}")
+    print(f"Processing {year} for grid visualization")
+    print(f"{'=' * 60}")
+
+    # Load data using existing function
+    with run_report.stage(report, 'load'):
+        df, meta = pwd_module.load_data(year, use_cache=use_cache)
+    run_report.add_rows(report, len(df))
+
+    table = build_grid_table(df, year, meta, report)
+    with run_report.stage(report, 'aggregate'):
+        output_data = build_grid_data(table, year, meta)
+
     # Save to JSON
     output_file = OUTPUT_PATH / f'grid_viz_data_{year}.json'
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
+    with run_report.stage(report, 'serialize'):
+        pwd_module.save_json(output_data, output_file, precompress)
+        pwd_module.remove_compact_sibling(output_file)
 
     print(f"✓ Saved to {output_file}")
     print(f"  ZIP codes with data: {len(output_data['zip_codes'])}")
@@ -193,21 +213,27 @@ def process_year_for_grid(year):
     return output_data
 
 
-def main():
+def main(workers=1, use_cache=True):
+    started = time.time()
     print("=" * 60)
     print("Grid Visualization Data Preparation")
     print("=" * 60)
 
     all_results = {}
+    wave_reports = {}
+    all_years = run_report.new_wave_report()
+
+    process = partial(run_report.timed_wave, process_year_for_grid, use_cache=use_cache)
+    for year, (result, report) in pwd_module.run_waves(process, pwd_module.YEARS, workers):
+        all_results[year] = result
+        wave_reports[year] = report
+
+    with run_report.stage(all_years, 'serialize'):
+        output_manifest.write_manifest()
 
-    for year in [1992, 1997, 2002, 2007, 2012, 2017, 2022]:
-        try:
-            result = process_year_for_grid(year)
-            all_results[year] = result
-        except Exception as e:
-            print(f"✗ Error processing {year}: {e}")
-            import traceback
-            traceback.print_exc()
+    pwd_module.write_run_report('prepare_grid_visualization_data.py', wave_reports, started,
+                                all_years['stages'], {'workers': workers, 'use_cache': use_cache},
+                                OUTPUT_PATH)
 
     print("\n" + "=" * 60)
     print("Summary")
@@ -219,4 +245,5 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    args = pwd_module.parse_args('Prepare grid visualization data with age groups and ZIP codes.')
+    main(workers=args.workers, use_cache=args.use_cache)
@@ -9,8 +9,18 @@ import pandas as pd
 import numpy as np
 import pyreadstat
 import json
+import argparse
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from collections import defaultdict
+
+import output_manifest
+import run_report
+import static_compression
+import wave_cache
 
 # Data path
 DATA_PATH = Path('/home/mulkooo/visualization/vi_data')
@@ -41,6 +51,9 @@ FILE_MAPPING = {
     2022: 'tscs221.sav'
 }
 
+# Survey waves in processing/output order
+YEARS = [1992, 1997, 2002, 2007, 2012, 2017, 2022]
+
 # Variable configurations per year
 VAR_CONFIG = {
     1992: {
@@ -102,22 +115,126 @@ VAR_CONFIG = {
     }
 }
 
+# Age specification per year (see prepare_grid_visualization_data.age_column):
+# primary column, ROC-year offset when the primary column is a birth year,
+# and a fallback age column used when the primary value is missing
+AGE_CONFIG = {
+    1992: {'primary': 'age', 'roc_offset': None, 'fallback': None},
+    1997: {'primary': 'age', 'roc_offset': None, 'fallback': None},
+    2002: {'primary': 'age', 'roc_offset': None, 'fallback': None},
+    2007: {'primary': 'age', 'roc_offset': None, 'fallback': None},
+    2012: {'primary': 'v2r_3', 'roc_offset': None, 'fallback': None},
+    2017: {'primary': 'a2y', 'roc_offset': 1911, 'fallback': 'a2a'},
+    2022: {'primary': 'a2y', 'roc_offset': 1911, 'fallback': 'a2r'}
+}
+
 # Objective wealth categories (5 levels)
 OBJECTIVE_CLASSES = ['低', '中低', '中等', '中高', '高']
 
 # Subjective wealth categories (6 levels)
 SUBJECTIVE_CLASSES = ['下層階級', '勞工階級', '中下層階級', '中層階級', '中上層階級', '上層階級']
 
+# Value-label fragments that mark a non-response
+MISSING_LABEL_MARKERS = ['不知道', '拒答', '跳答', '漏答', '無意見', '無反應']
+
+
+def income_columns(year, config):
+    """
+    Income variables that are decoded for a year: 1992 sums personal incomes,
+    later waves use the first (household) variable only.
+    """
+    return config['income_vars'] if year == 1992 else config['income_vars'][:1]
 
-def load_data(year):
-    """Load SPSS data for a given year."""
+
+def get_used_columns(year):
+    """List the SPSS variables the pipeline reads for a given year."""
+    config = VAR_CONFIG[year]
+    columns = []
+    for key, value in config.items():
+        if value is None:
+            continue
+        if key == 'income_vars':
+            value = income_columns(year, config)
+        columns.extend(value if isinstance(value, list) else [value])
+    age_spec = AGE_CONFIG[year]
+    columns.extend(name for name in (age_spec['primary'], age_spec['fallback']) if name)
+    return list(dict.fromkeys(columns))
+
+
+def load_data(year, usecols=None, use_cache=True):
+    """
+    Load SPSS data for a given year.
+    Only the variables from get_used_columns (and their value labels) are
+    parsed unless usecols is given explicitly. Decoded waves are kept in
+    wave_cache and reused while the .sav file is unchanged.
+    """
     file_path = DATA_PATH / FILE_MAPPING[year]
+    if usecols is None:
+        usecols = get_used_columns(year)
     print(f"  Loading {file_path.name}...")
-    df, meta = pyreadstat.read_sav(str(file_path))
+
+    cache_key = wave_cache.get_cache_key(file_path, usecols) if use_cache else None
+    cached = wave_cache.load_cached_wave(cache_key) if cache_key else None
+    if cached:
+        df, meta = cached
+        print(f"  Loaded {len(df)} records with {len(df.columns)} variables (cached)")
+        return df, meta
+
+    df, meta = pyreadstat.read_sav(str(file_path), usecols=usecols)
+    if cache_key:
+        wave_cache.store_cached_wave(cache_key, df, meta)
     print(f"  Loaded {len(df)} records with {len(df.columns)} variables")
     return df, meta
 
 
+def load_metadata(year, usecols=None):
+    """Read only the SPSS metadata (row count, value labels) for a given year."""
+    file_path = DATA_PATH / FILE_MAPPING[year]
+    if usecols is None:
+        usecols = get_used_columns(year)
+    _, meta = pyreadstat.read_sav(str(file_path), metadataonly=True, usecols=usecols)
+    return meta
+
+
+def load_data_rows(year, row_offset, row_limit, usecols=None):
+    """Load one row range of a year's SPSS data (bypasses the wave cache)."""
+    file_path = DATA_PATH / FILE_MAPPING[year]
+    if usecols is None:
+        usecols = get_used_columns(year)
+    print(f"  Loading {file_path.name} rows {row_offset:,}-{row_offset + row_limit - 1:,}...")
+    return pyreadstat.read_sav(str(file_path), usecols=usecols,
+                               row_offset=row_offset, row_limit=row_limit)
+
+
+def iter_data_chunks(year, chunksize, usecols=None, row_offset=0, row_limit=0):
+    """
+    Stream SPSS data for a given year as (df, meta) chunks of chunksize rows,
+    optionally restricted to row_limit rows starting at row_offset (0 = to the end).
+    Peak memory is bounded by the chunk size; the wave cache is not used.
+    """
+    file_path = DATA_PATH / FILE_MAPPING[year]
+    if usecols is None:
+        usecols = get_used_columns(year)
+    print(f"  Streaming {file_path.name} in chunks of {chunksize:,} rows...")
+
+    # pyreadstat.read_file_in_chunks reads past `limit` on the last chunk,
+    # so the range end is enforced here
+    number_rows = load_metadata(year, usecols).number_rows
+    end = row_offset + row_limit if row_limit else number_rows
+    if number_rows and end:
+        end = min(end, number_rows)
+
+    offset = row_offset
+    while end is None or offset < end:
+        limit = chunksize if end is None else min(chunksize, end - offset)
+        df, meta = pyreadstat.read_sav(str(file_path), usecols=usecols,
+                                       row_offset=offset, row_limit=limit)
+        if len(df) == 0:
+            break
+        yield df, meta
+        offset += len(df)
+
+
 def classify_objective_wealth(annual_income, year):
     """
     Classify household income into 5 quintile categories.
@@ -140,112 +257,150 @@ def classify_objective_wealth(annual_income, year):
         return '高'
 
 
-def convert_income_code_to_monthly(code, year):
+def classify_objective_wealth_codes(annual_income, year):
     """
-    Convert categorical income code to estimated monthly amount (midpoint of range).
-    Returns monthly income in NT$ or None.
+    Batch version of classify_objective_wealth.
+    Returns int8 quintile codes indexing OBJECTIVE_CLASSES, -1 for missing.
     """
-    if pd.isna(code) or code >= 90:
-        return None
+    annual_income = np.asarray(annual_income, dtype=float)
+    # side='right' puts an income equal to a threshold into the upper class
+    codes = np.searchsorted(INCOME_THRESHOLDS[year][:-1], annual_income, side='right')
+    valid = annual_income > 0
+    return np.where(valid, codes, -1).astype(np.int8)
 
-    code = int(code)
 
-    if year == 1992:
-        # v80/v81 income ranges
-        ranges = {
-            1: 0,       # 無收入
-            2: 5000,    # 1萬元以下 → 5千
-            3: 15000,   # 1-2萬元 → 1.5萬
-            4: 25000,   # 2-3萬元
-            5: 35000,   # 3-4萬元
-            6: 45000,   # 4-5萬元
-            7: 55000,   # 5-6萬元
-            8: 65000,   # 6-7萬元
-            9: 75000,   # 7-8萬元
-            10: 85000,  # 8-9萬元
-            11: 95000,  # 9-10萬元
-            12: 105000, # 10-11萬元
-            13: 115000, # 11-12萬元
-            14: 125000, # 12-13萬元
-            15: 135000, # 13-14萬元
-            16: 145000, # 14-15萬元
-            17: 155000, # 15-16萬元
-            18: 165000, # 16-17萬元
-            19: 175000, # 17-18萬元
-            20: 185000, # 18-19萬元
-            21: 195000, # 19-20萬元
-            22: 250000  # 20萬元以上 → 25萬估計
-        }
-        return ranges.get(code)
+def objective_class_labels(codes):
+    """Turn objective class codes into OBJECTIVE_CLASSES labels (None for -1)."""
+    labels = np.array(OBJECTIVE_CLASSES + [None], dtype=object)
+    return labels[np.asarray(codes)]
 
-    elif year == 1997:
-        ranges = {
-            1: 0, 2: 10000, 3: 30000, 4: 50000, 5: 70000, 6: 90000,
-            7: 110000, 8: 130000, 9: 150000, 10: 170000, 11: 190000,
-            12: 210000, 13: 230000, 14: 250000, 15: 270000, 16: 290000,
-            17: 310000, 18: 330000, 19: 350000, 20: 370000, 21: 390000,
-            22: 450000
-        }
-        return ranges.get(code)
 
-    elif year == 2002:
+# Income code → estimated monthly amount (midpoint of range, NT$)
+INCOME_CODE_RANGES = {
+    1992: {
+        # v80/v81 income ranges
+        1: 0,       # 無收入
+        2: 5000,    # 1萬元以下 → 5千
+        3: 15000,   # 1-2萬元 → 1.5萬
+        4: 25000,   # 2-3萬元
+        5: 35000,   # 3-4萬元
+        6: 45000,   # 4-5萬元
+        7: 55000,   # 5-6萬元
+        8: 65000,   # 6-7萬元
+        9: 75000,   # 7-8萬元
+        10: 85000,  # 8-9萬元
+        11: 95000,  # 9-10萬元
+        12: 105000, # 10-11萬元
+        13: 115000, # 11-12萬元
+        14: 125000, # 12-13萬元
+        15: 135000, # 13-14萬元
+        16: 145000, # 14-15萬元
+        17: 155000, # 15-16萬元
+        18: 165000, # 16-17萬元
+        19: 175000, # 17-18萬元
+        20: 185000, # 18-19萬元
+        21: 195000, # 19-20萬元
+        22: 250000  # 20萬元以上 → 25萬估計
+    },
+    1997: {
+        1: 0, 2: 10000, 3: 30000, 4: 50000, 5: 70000, 6: 90000,
+        7: 110000, 8: 130000, 9: 150000, 10: 170000, 11: 190000,
+        12: 210000, 13: 230000, 14: 250000, 15: 270000, 16: 290000,
+        17: 310000, 18: 330000, 19: 350000, 20: 370000, 21: 390000,
+        22: 450000
+    },
+    2002: {
         # v146b household income ranges
-        ranges = {
-            1: 0, 2: 5000, 3: 15000, 4: 25000, 5: 35000, 6: 45000,
-            7: 55000, 8: 65000, 9: 75000, 10: 85000, 11: 95000, 12: 105000,
-            13: 115000, 14: 125000, 15: 135000, 16: 145000, 17: 155000,
-            18: 165000, 19: 175000, 20: 185000, 21: 195000, 22: 225000,
-            23: 275000, 24: 325000, 25: 375000, 26: 425000, 27: 475000,
-            28: 550000, 29: 650000, 30: 750000, 31: 850000, 32: 950000,
-            33: 1200000  # 100萬以上
-        }
-        return ranges.get(code)
-
-    elif year == 2007:
+        1: 0, 2: 5000, 3: 15000, 4: 25000, 5: 35000, 6: 45000,
+        7: 55000, 8: 65000, 9: 75000, 10: 85000, 11: 95000, 12: 105000,
+        13: 115000, 14: 125000, 15: 135000, 16: 145000, 17: 155000,
+        18: 165000, 19: 175000, 20: 185000, 21: 195000, 22: 225000,
+        23: 275000, 24: 325000, 25: 375000, 26: 425000, 27: 475000,
+        28: 550000, 29: 650000, 30: 750000, 31: 850000, 32: 950000,
+        33: 1200000  # 100萬以上
+    },
+    2007: {
         # h45 household income ranges
-        ranges = {
-            1: 0, 2: 5000, 3: 15000, 4: 25000, 5: 35000, 6: 45000,
-            7: 55000, 8: 65000, 9: 75000, 10: 85000, 11: 95000, 12: 105000,
-            13: 115000, 14: 125000, 15: 135000, 16: 145000, 17: 155000,
-            18: 165000, 19: 175000, 20: 185000, 21: 195000, 22: 225000,
-            23: 275000, 24: 325000, 25: 375000, 26: 700000,  # 40-100萬
-            27: 1200000  # 100萬以上
-        }
-        return ranges.get(code)
-
-    elif year == 2012:
+        1: 0, 2: 5000, 3: 15000, 4: 25000, 5: 35000, 6: 45000,
+        7: 55000, 8: 65000, 9: 75000, 10: 85000, 11: 95000, 12: 105000,
+        13: 115000, 14: 125000, 15: 135000, 16: 145000, 17: 155000,
+        18: 165000, 19: 175000, 20: 185000, 21: 195000, 22: 225000,
+        23: 275000, 24: 325000, 25: 375000, 26: 700000,  # 40-100萬
+        27: 1200000  # 100萬以上
+    },
+    2012: {
         # v108 household income ranges
-        ranges = {
-            1: 0, 2: 5000, 3: 15000, 4: 25000, 5: 35000, 6: 45000,
-            7: 55000, 8: 65000, 9: 75000, 10: 85000, 11: 95000, 12: 105000,
-            13: 115000, 14: 125000, 15: 135000, 16: 145000, 17: 155000,
-            18: 165000, 19: 175000, 20: 185000, 21: 195000, 22: 250000,
-            23: 350000, 24: 450000, 25: 750000, 26: 1200000  # 100萬以上
-        }
-        return ranges.get(code)
-
-    elif year == 2017:
+        1: 0, 2: 5000, 3: 15000, 4: 25000, 5: 35000, 6: 45000,
+        7: 55000, 8: 65000, 9: 75000, 10: 85000, 11: 95000, 12: 105000,
+        13: 115000, 14: 125000, 15: 135000, 16: 145000, 17: 155000,
+        18: 165000, 19: 175000, 20: 185000, 21: 195000, 22: 250000,
+        23: 350000, 24: 450000, 25: 750000, 26: 1200000  # 100萬以上
+    },
+    2017: {
         # f7 uses similar encoding to 2022
-        ranges = {
-            1: 0, 2: 5000, 3: 15000, 4: 25000, 5: 35000, 6: 45000,
-            7: 55000, 8: 65000, 9: 75000, 10: 85000, 11: 95000, 12: 105000,
-            13: 115000, 14: 125000, 15: 135000, 16: 145000, 17: 155000,
-            18: 165000, 19: 175000, 20: 185000, 21: 195000, 22: 250000,
-            23: 350000, 24: 450000, 25: 750000, 26: 1500000
-        }
-        return ranges.get(code)
+        1: 0, 2: 5000, 3: 15000, 4: 25000, 5: 35000, 6: 45000,
+        7: 55000, 8: 65000, 9: 75000, 10: 85000, 11: 95000, 12: 105000,
+        13: 115000, 14: 125000, 15: 135000, 16: 145000, 17: 155000,
+        18: 165000, 19: 175000, 20: 185000, 21: 195000, 22: 250000,
+        23: 350000, 24: 450000, 25: 750000, 26: 1500000
+    },
+    2022: {
+        1: 0, 2: 5000, 3: 15000, 4: 25000, 5: 35000, 6: 45000,
+        7: 55000, 8: 65000, 9: 75000, 10: 85000, 11: 95000, 12: 105000,
+        13: 115000, 14: 125000, 15: 135000, 16: 145000, 17: 155000,
+        18: 165000, 19: 175000, 20: 185000, 21: 195000, 22: 250000,
+        23: 350000, 24: 450000, 25: 750000, 26: 1500000
+    }
+}
 
-    elif year == 2022:
-        ranges = {
-            1: 0, 2: 5000, 3: 15000, 4: 25000, 5: 35000, 6: 45000,
-            7: 55000, 8: 65000, 9: 75000, 10: 85000, 11: 95000, 12: 105000,
-            13: 115000, 14: 125000, 15: 135000, 16: 145000, 17: 155000,
-            18: 165000, 19: 175000, 20: 185000, 21: 195000, 22: 250000,
-            23: 350000, 24: 450000, 25: 750000, 26: 1500000
-        }
-        return ranges.get(code)
+# Codes at or above this value are non-responses (不知道, 拒答, ...)
+INCOME_MISSING_CODE = 90
 
-    return None
+
+def build_income_code_table(ranges):
+    """
+    Build a dense lookup table indexed by income code.
+    Codes without a defined range map to NaN.
+    """
+    table = np.full(INCOME_MISSING_CODE, np.nan)
+    for code, amount in ranges.items():
+        table[code] = amount
+    return table
+
+
+# Precompiled per-year tables: INCOME_CODE_TABLES[year][code] → monthly NT$
+INCOME_CODE_TABLES = {year: build_income_code_table(ranges)
+                      for year, ranges in INCOME_CODE_RANGES.items()}
+
+
+def decode_income_codes(codes, year):
+    """
+    Convert an array of income codes to monthly amounts in one gather.
+    Missing codes (NaN, >= 90 or undefined) become NaN.
+    """
+    codes = np.asarray(codes, dtype=float)
+    table = INCOME_CODE_TABLES.get(year)
+    if table is None:
+        return np.full(codes.shape, np.nan)
+
+    valid = (codes >= 0) & (codes < len(table))
+    indexes = np.where(valid, codes, 0).astype(np.intp)
+    return np.where(valid, table[indexes], np.nan)
+
+
+def convert_income_code_to_monthly(code, year):
+    """
+    Convert categorical income code to estimated monthly amount (midpoint of range).
+    Returns monthly income in NT$ or None.
+    """
+    if pd.isna(code) or code >= INCOME_MISSING_CODE:
+        return None
+
+    monthly = decode_income_codes(code, year)
+    if np.isnan(monthly):
+        return None
+
+    return int(monthly)
 
 
 def get_household_income(row, year, config):
@@ -323,6 +478,27 @@ def get_household_income(row, year, config):
     return np.nan
 
 
+def classify_subjective_label(label):
+    """Map a subjective-class value label to one of SUBJECTIVE_CLASSES (or None)."""
+    if not label or any(x in label for x in MISSING_LABEL_MARKERS):
+        return None
+
+    if '上層' in label and '中上' not in label:
+        return '上層階級'
+    elif '中上' in label:
+        return '中上層階級'
+    elif '中層' in label and '中上' not in label and '中下' not in label:
+        return '中層階級'
+    elif '中下' in label:
+        return '中下層階級'
+    elif '勞工' in label:
+        return '勞工階級'
+    elif '下層' in label:
+        return '下層階級'
+
+    return None
+
+
 def get_subjective_class(row, year, meta):
     """Extract subjective wealth class from row."""
     config = VAR_CONFIG[year]
@@ -335,7 +511,7 @@ def get_subjective_class(row, year, meta):
     value_labels = meta.variable_value_labels.get(var_name, {})
     label = value_labels.get(value, None)
 
-    if label and any(x in label for x in ['不知道', '拒答', '跳答', '漏答', '無意見', '無反應']):
+    if label and any(x in label for x in MISSING_LABEL_MARKERS):
         return None
 
     if year == 2002:
@@ -347,21 +523,7 @@ def get_subjective_class(row, year, meta):
             if '中下' in v126_label and ('工' in v125_label or '農民' in v125_label):
                 return '勞工階級'
 
-    if label:
-        if '上層' in label and '中上' not in label:
-            return '上層階級'
-        elif '中上' in label:
-            return '中上層階級'
-        elif '中層' in label and '中上' not in label and '中下' not in label:
-            return '中層階級'
-        elif '中下' in label:
-            return '中下層階級'
-        elif '勞工' in label:
-            return '勞工階級'
-        elif '下層' in label:
-            return '下層階級'
-
-    return None
+    return classify_subjective_label(label)
 
 
 def get_happiness(row, year, meta):
@@ -392,13 +554,72 @@ def should_exclude_1992_housewife(row, annual_income):
     return False
 
 
-def process_year(year):
-    """Process data for a single year."""
-    print(f"\n{'='*60}")
-    print(f"Processing {year}")
-    print(f"{'='*60}")
+def get_column(df, var_name):
+    """Return a column as float Series, or all-NaN when the wave lacks it."""
+    if var_name and var_name in df.columns:
+        return df[var_name].astype(float)
+    return pd.Series(np.nan, index=df.index)
+
+
+def household_income_column(df, year, config):
+    """
+    Columnar counterpart of get_household_income.
+    Returns a float Series of annual income in NT$ (NaN when unknown).
+    """
+    monthly_income = pd.Series(0.0, index=df.index)
+    for var_name in income_columns(year, config):
+        monthly = decode_income_codes(get_column(df, var_name), year)
+        monthly_income = monthly_income + np.nan_to_num(monthly)
+
+    return (monthly_income * 12).where(monthly_income > 0)
+
+
+def build_subjective_class_map(meta, var_name):
+    """
+    Build a code → subjective class table from the SPSS value labels.
+    Codes whose label is a non-response (or unrecognised) map to None.
+    """
+    value_labels = meta.variable_value_labels.get(var_name, {})
+    return {code: classify_subjective_label(label) for code, label in value_labels.items()}
+
+
+def find_label_codes(meta, var_name, predicate):
+    """Return the codes of var_name whose value label satisfies predicate."""
+    value_labels = meta.variable_value_labels.get(var_name, {})
+    return [code for code, label in value_labels.items() if label and predicate(label)]
+
 
-    df, meta = load_data(year)
+def subjective_class_column(df, year, meta):
+    """Columnar counterpart of get_subjective_class."""
+    config = VAR_CONFIG[year]
+    class_map = build_subjective_class_map(meta, config['subjective'])
+    classes = get_column(df, config['subjective']).map(class_map)
+
+    if year == 2002:
+        # 中下 respondents who report a labor/farming class (v125) count as 勞工階級
+        lower_middle_codes = find_label_codes(
+            meta, 'v126',
+            lambda label: '中下' in label and not any(x in label for x in MISSING_LABEL_MARKERS)
+        )
+        labor_codes = find_label_codes(
+            meta, 'v125',
+            lambda label: '工' in label or '農民' in label
+        )
+        labor = (get_column(df, 'v126').isin(lower_middle_codes) &
+                 get_column(df, 'v125').isin(labor_codes))
+        classes = classes.mask(labor, '勞工階級')
+
+    return classes.astype(object).where(classes.notna(), None)
+
+
+def happiness_column(df, year):
+    """Columnar counterpart of get_happiness (NaN for missing)."""
+    happiness = get_column(df, VAR_CONFIG[year].get('happiness'))
+    return happiness.where(happiness < 90)
+
+
+def build_records_rowwise(df, year, meta):
+    """Build Sankey records one respondent at a time (reference path)."""
     config = VAR_CONFIG[year]
 
     records = []
@@ -437,93 +658,367 @@ def process_year(year):
                 'zip': zip_code
             })
 
+    return records, excluded_count, missing_subjective, missing_objective
+
+
+def build_respondent_table(df, year, meta, report=None):
+    """
+    Derive the canonical per-respondent table for one wave.
+    Every output (Sankey, comparison, grid) is computed from this table.
+    Decoding the survey codes and classifying respondents are timed as the
+    'decode' and 'classify' stages of report (see run_report.py).
+    """
+    config = VAR_CONFIG[year]
+
+    with run_report.stage(report, 'decode'):
+        annual_income = household_income_column(df, year, config)
+        happiness = happiness_column(df, year)
+        zip_code = get_column(df, config['zip'])
+        gender = get_column(df, config['gender'])
+
+    with run_report.stage(report, 'classify'):
+        if year == 1992:
+            excluded = (get_column(df, 'v1') == 2) & (annual_income < 117876)
+        else:
+            excluded = pd.Series(False, index=df.index)
+
+        objective = objective_class_labels(classify_objective_wealth_codes(annual_income, year))
+        subjective = subjective_class_column(df, year, meta)
+
+    return pd.DataFrame({
+        'annual_income': annual_income,
+        'objective_class': objective,
+        'subjective_class': subjective,
+        'happiness': happiness,
+        'zip_code': zip_code,
+        'gender': gender,
+        'excluded': excluded
+    }, index=df.index)
+
+
+def records_from_table(table):
+    """Build Sankey records (and exclusion statistics) from a respondent table."""
+    kept = ~table['excluded']
+    subjective = table['subjective_class']
+    objective = table['objective_class']
+
+    valid = kept & subjective.notna() & objective.notna()
+
+    records = [
+        {
+            'subjective': subj,
+            'objective': obj,
+            'happiness': None if np.isnan(happy) else happy,
+            'zip': None if np.isnan(zip_code) else int(zip_code)
+        }
+        for subj, obj, happy, zip_code in zip(
+            subjective[valid].tolist(),
+            objective[valid].tolist(),
+            table.loc[valid, 'happiness'].tolist(),
+            table.loc[valid, 'zip_code'].tolist()
+        )
+    ]
+
+    excluded_count = int(table['excluded'].sum())
+    missing_subjective = int((kept & subjective.isna()).sum())
+    missing_objective = int((kept & objective.isna()).sum())
+
+    return records, excluded_count, missing_subjective, missing_objective
+
+
+def build_records_columnar(df, year, meta, report=None):
+    """Build the same records as build_records_rowwise with column operations."""
+    table = build_respondent_table(df, year, meta, report)
+    with run_report.stage(report, 'aggregate'):
+        return records_from_table(table)
+
+
+def print_statistics(total, valid, excluded_count, missing_subjective, missing_objective):
+    """Print the per-wave record statistics."""
     print(f"\n  Statistics:")
-    print(f"    Total records: {len(df)}")
-    print(f"    Valid records: {len(records)}")
+    print(f"    Total records: {total}")
+    print(f"    Valid records: {valid}")
     print(f"    Excluded (1992 housewives): {excluded_count}")
     print(f"    Missing subjective: {missing_subjective}")
     print(f"    Missing objective: {missing_objective}")
 
-    return records
 
+def process_year(year, columnar=True, use_cache=True, report=None):
+    """
+    Process data for a single year.
+    columnar=False falls back to the row-by-row reference implementation
+    (timed as a single 'aggregate' stage).
+    Stage timings and the row count are added to report when given.
+    """
+    print(f"\n{'='*60}")
+    print(f"Processing {year}")
+    print(f"{'='*60}")
+
+    with run_report.stage(report, 'load'):
+        df, meta = load_data(year, use_cache=use_cache)
+    run_report.add_rows(report, len(df))
 
-def generate_sankey_data(records, year):
-    """Generate Sankey diagram data structure."""
-    flow_counts = defaultdict(int)
+    if columnar:
+        records, excluded_count, missing_subjective, missing_objective = build_records_columnar(
+            df, year, meta, report)
+    else:
+        with run_report.stage(report, 'aggregate'):
+            records, excluded_count, missing_subjective, missing_objective = build_records_rowwise(
+                df, year, meta)
 
-    for record in records:
-        key = (record['subjective'], record['objective'])
-        flow_counts[key] += 1
+    print_statistics(len(df), len(records), excluded_count, missing_subjective, missing_objective)
 
-    subjective_nodes = sorted(set(r['subjective'] for r in records),
-                             key=lambda x: SUBJECTIVE_CLASSES.index(x))
-    objective_nodes = sorted(set(r['objective'] for r in records),
-                            key=lambda x: OBJECTIVE_CLASSES.index(x))
+    return records
 
-    links = []
-    for (subj, obj), count in flow_counts.items():
-        links.append({
-            'source': subj,
-            'target': obj,
-            'value': count
-        })
 
-    subjective_counts = defaultdict(int)
-    objective_counts = defaultdict(int)
+def encode_classes(labels, classes):
+    """Encode class labels as int8 indexes into classes (-1 for missing)."""
+    return pd.Categorical(labels, categories=classes).codes
 
-    for record in records:
-        subjective_counts[record['subjective']] += 1
-        objective_counts[record['objective']] += 1
+
+def build_sankey_matrix(subjective_codes, objective_codes):
+    """
+    Build the subjective × objective contingency table in one pass.
+    Returns an int64 array of shape (len(SUBJECTIVE_CLASSES), len(OBJECTIVE_CLASSES)).
+    """
+    shape = (len(SUBJECTIVE_CLASSES), len(OBJECTIVE_CLASSES))
+    flat_index = np.ravel_multi_index(
+        (np.asarray(subjective_codes, dtype=np.intp), np.asarray(objective_codes, dtype=np.intp)),
+        shape
+    )
+    return np.bincount(flat_index, minlength=shape[0] * shape[1]).reshape(shape)
+
+
+def sankey_data_from_matrix(matrix, year):
+    """Derive Sankey nodes, links and marginals from a contingency table."""
+    by_subjective = matrix.sum(axis=1)
+    by_objective = matrix.sum(axis=0)
+
+    links = [
+        {
+            'source': SUBJECTIVE_CLASSES[subj],
+            'target': OBJECTIVE_CLASSES[obj],
+            'value': int(matrix[subj, obj])
+        }
+        for subj, obj in zip(*np.nonzero(matrix))
+    ]
 
     return {
         'year': year,
-        'total_samples': len(records),
+        'total_samples': int(matrix.sum()),
         'nodes': {
-            'subjective': subjective_nodes,
-            'objective': objective_nodes
+            'subjective': [SUBJECTIVE_CLASSES[i] for i in np.flatnonzero(by_subjective)],
+            'objective': [OBJECTIVE_CLASSES[i] for i in np.flatnonzero(by_objective)]
         },
         'links': links,
         'summary': {
-            'by_subjective': dict(subjective_counts),
-            'by_objective': dict(objective_counts)
+            'by_subjective': {SUBJECTIVE_CLASSES[i]: int(by_subjective[i])
+                              for i in np.flatnonzero(by_subjective)},
+            'by_objective': {OBJECTIVE_CLASSES[i]: int(by_objective[i])
+                             for i in np.flatnonzero(by_objective)}
         }
     }
 
 
+def sankey_matrix_from_records(records):
+    """Contingency table of a list of Sankey records."""
+    subjective_codes = encode_classes([r['subjective'] for r in records], SUBJECTIVE_CLASSES)
+    objective_codes = encode_classes([r['objective'] for r in records], OBJECTIVE_CLASSES)
+    return build_sankey_matrix(subjective_codes, objective_codes)
+
+
+def generate_sankey_data(records, year):
+    """Generate Sankey diagram data structure."""
+    return sankey_data_from_matrix(sankey_matrix_from_records(records), year)
+
+
+def empty_moments():
+    """Running count/mean/M2 state for one streamed variable."""
+    return {'count': 0, 'mean': 0.0, 'm2': 0.0}
+
+
+def chunk_moments(values):
+    """Moments of one chunk of values (NaN entries are ignored)."""
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return empty_moments()
+    mean = values.mean()
+    return {'count': len(values), 'mean': float(mean), 'm2': float(((values - mean) ** 2).sum())}
+
+
+def merge_moments(a, b):
+    """
+    Combine two moment states (Welford/Chan parallel update).
+    Works for consecutive chunks as well as partial results from workers.
+    """
+    count = a['count'] + b['count']
+    if count == 0:
+        return empty_moments()
+    delta = b['mean'] - a['mean']
+    return {
+        'count': count,
+        'mean': a['mean'] + delta * b['count'] / count,
+        'm2': a['m2'] + b['m2'] + delta * delta * a['count'] * b['count'] / count
+    }
+
+
+def empty_score_state():
+    """Score accumulator state for calculate_wealth_scores."""
+    return {'subjective': empty_moments(), 'objective': empty_moments(), 'happiness': empty_moments()}
+
+
+def update_score_state(state, subjective_codes, objective_codes, happiness):
+    """
+    Fold one chunk of encoded records into a score state.
+    subjective_codes/objective_codes index SUBJECTIVE_CLASSES/OBJECTIVE_CLASSES;
+    happiness uses NaN for missing values.
+    """
+    subjective_scores = np.asarray(subjective_codes, dtype=float) / (len(SUBJECTIVE_CLASSES) - 1)
+    objective_scores = np.asarray(objective_codes, dtype=float) / (len(OBJECTIVE_CLASSES) - 1)
+    return merge_score_states(state, {
+        'subjective': chunk_moments(subjective_scores),
+        'objective': chunk_moments(objective_scores),
+        'happiness': chunk_moments(happiness)
+    })
+
+
+def merge_score_states(a, b):
+    """Combine two score states."""
+    return {key: merge_moments(a[key], b[key]) for key in a}
+
+
+def score_state_results(state):
+    """Final averages (and happiness standard deviation) of a score state."""
+    def mean(moments):
+        return moments['mean'] if moments['count'] else None
+
+    happiness = state['happiness']
+    return {
+        'subjective_avg': mean(state['subjective']),
+        'objective_avg': mean(state['objective']),
+        'happiness_avg': mean(happiness),
+        'happiness_std': np.sqrt(happiness['m2'] / happiness['count']) if happiness['count'] else None
+    }
+
+
 def calculate_wealth_scores(records):
     """Calculate average wealth scores for comparison chart."""
-    subjective_scores = []
-    objective_scores = []
-    happiness_scores = []
+    state = update_score_state(
+        empty_score_state(),
+        encode_classes([r['subjective'] for r in records], SUBJECTIVE_CLASSES),
+        encode_classes([r['objective'] for r in records], OBJECTIVE_CLASSES),
+        [np.nan if r['happiness'] is None else r['happiness'] for r in records]
+    )
+    return score_state_results(state)
+
 
-    for record in records:
-        subj_idx = SUBJECTIVE_CLASSES.index(record['subjective'])
-        subj_score = subj_idx / (len(SUBJECTIVE_CLASSES) - 1)
-        subjective_scores.append(subj_score)
+def build_wealth_cube(matrices_by_year, scores_by_year):
+    """
+    Bundle every year into one year × objective × subjective count cube,
+    with the heatmap cells (average subjective score per objective class and
+    perception gap) and the comparison series precomputed.
+    """
+    subjective_scores = np.arange(1, len(SUBJECTIVE_CLASSES) + 1)
+    counts = []
+    heatmap = []
+
+    for year, matrix in matrices_by_year.items():
+        by_objective = np.asarray(matrix).T
+        counts.append(by_objective.tolist())
+
+        for objective_index, objective in enumerate(OBJECTIVE_CLASSES):
+            class_counts = by_objective[objective_index]
+            total = int(class_counts.sum())
+            subjective_avg = perception_gap = None
+            if total:
+                subjective_avg = float(class_counts @ subjective_scores / total)
+                # Map the 1-6 subjective scale onto the 1-5 objective scale
+                normalized_subjective = (subjective_avg - 1) * (4 / 5) + 1
+                perception_gap = abs(normalized_subjective - (objective_index + 1))
+            heatmap.append({
+                'year': year,
+                'objective': objective,
+                'subjective_avg': subjective_avg,
+                'perception_gap': perception_gap,
+                'count': total
+            })
 
-        obj_idx = OBJECTIVE_CLASSES.index(record['objective'])
-        obj_score = obj_idx / (len(OBJECTIVE_CLASSES) - 1)
-        objective_scores.append(obj_score)
+    return {
+        'years': list(matrices_by_year),
+        'objective': OBJECTIVE_CLASSES,
+        'subjective': SUBJECTIVE_CLASSES,
+        'counts': counts,
+        'heatmap': heatmap,
+        'comparison': build_comparison_data(scores_by_year)
+    }
 
-        if record['happiness'] is not None:
-            happiness_scores.append(record['happiness'])
 
+def empty_wealth_aggregates():
+    """Mergeable per-wave aggregates behind the Sankey and comparison outputs."""
     return {
-        'subjective_avg': np.mean(subjective_scores) if subjective_scores else None,
-        'objective_avg': np.mean(objective_scores) if objective_scores else None,
-        'happiness_avg': np.mean(happiness_scores) if happiness_scores else None,
-        'happiness_std': np.std(happiness_scores) if happiness_scores else None
+        'total': 0,
+        'valid': 0,
+        'excluded': 0,
+        'missing_subjective': 0,
+        'missing_objective': 0,
+        'sankey': np.zeros((len(SUBJECTIVE_CLASSES), len(OBJECTIVE_CLASSES)), dtype=np.int64),
+        'scores': empty_score_state()
     }
 
 
-def main():
-    """Main processing function."""
-    print("\n" + "="*60)
-    print("Taiwan Social Change Survey - Wealth Data Preparation v2")
-    print("Processing 1992-2022 (7 survey waves)")
-    print("="*60)
+def wealth_aggregates_from_table(table):
+    """Reduce (a chunk of) a respondent table to wealth aggregates."""
+    kept = ~table['excluded']
+    subjective_codes = encode_classes(table['subjective_class'], SUBJECTIVE_CLASSES)
+    objective_codes = encode_classes(table['objective_class'], OBJECTIVE_CLASSES)
+    valid = kept.to_numpy() & (subjective_codes >= 0) & (objective_codes >= 0)
 
-    all_records = {}
+    return {
+        'total': len(table),
+        'valid': int(valid.sum()),
+        'excluded': int(table['excluded'].sum()),
+        'missing_subjective': int((kept & (subjective_codes < 0)).sum()),
+        'missing_objective': int((kept & (objective_codes < 0)).sum()),
+        'sankey': build_sankey_matrix(subjective_codes[valid], objective_codes[valid]),
+        'scores': update_score_state(empty_score_state(), subjective_codes[valid],
+                                     objective_codes[valid], table['happiness'].to_numpy()[valid])
+    }
+
+
+def merge_wealth_aggregates(a, b):
+    """Combine wealth aggregates of two chunks (or row ranges) of a wave."""
+    merged = {key: a[key] + b[key] for key in a if key != 'scores'}
+    merged['scores'] = merge_score_states(a['scores'], b['scores'])
+    return merged
+
+
+def save_json(data, output_file, precompress=True):
+    """
+    Write a processed output file, plus its .gz/.br siblings when precompress
+    is set.
+    """
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    if precompress:
+        static_compression.write_compressed_siblings(output_file)
+    else:
+        static_compression.remove_compressed_siblings(output_file)
+
+
+def remove_compact_sibling(output_file):
+    """
+    Remove the compact (.bin) version of a per-wave output written by an
+    earlier prepare_all_data.py --compact run, since the front end prefers it
+    over the JSON that was just rewritten.
+    """
+    compact_file = Path(output_file).with_suffix('.bin')
+    compact_file.unlink(missing_ok=True)
+    static_compression.remove_compressed_siblings(compact_file)
+
+
+def build_comparison_data(scores_by_year):
+    """Assemble comparison_data.json from per-year wealth scores."""
     comparison_data = {
         'years': [],
         'subjective_avg': [],
@@ -531,36 +1026,138 @@ def main():
         'happiness_avg': [],
         'happiness_std': []
     }
+    for year, scores in scores_by_year.items():
+        comparison_data['years'].append(year)
+        comparison_data['subjective_avg'].append(scores['subjective_avg'])
+        comparison_data['objective_avg'].append(scores['objective_avg'])
+        comparison_data['happiness_avg'].append(scores['happiness_avg'])
+        comparison_data['happiness_std'].append(scores['happiness_std'])
+    return comparison_data
 
-    years = [1992, 1997, 2002, 2007, 2012, 2017, 2022]
 
-    for year in years:
+def run_waves(func, years, workers=1):
+    """
+    Run func(year) for every wave, in a process pool when workers > 1.
+    Yields (year, result) in year order; a failing wave is reported and skipped.
+    """
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if executor:
+            futures = {year: executor.submit(func, year) for year in years}
+        for year in years:
+            try:
+                result = futures[year].result() if executor else func(year)
+            except Exception as e:
+                print(f"  ✗ Error processing {year}: {e}")
+                traceback.print_exc()
+                continue
+            yield year, result
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+
+def parse_args(description, incremental=False, streaming=False):
+    """
+    Parse the command-line options shared by the preparation scripts.
+    incremental=True adds --force for scripts that skip unchanged waves;
+    streaming=True adds --chunksize for scripts that can read waves in chunks.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    if incremental:
+        parser.add_argument('--force', action='store_true',
+                            help='rebuild every wave even if its inputs are unchanged')
+    if streaming:
+        parser.add_argument('--chunksize', type=int, default=None,
+                            help='stream each .sav file in chunks of this many rows')
+        parser.add_argument('--row-workers', type=int, default=1,
+                            help='split each .sav file into row ranges decoded by this many processes')
+        parser.add_argument('--compact', action='store_true',
+                            help='also write compact binary (.bin) grid and Sankey files')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes (0 = one per CPU core)')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help='always decode the .sav files instead of using the wave cache')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='remove all cached waves before processing')
+    args = parser.parse_args()
+    if args.workers <= 0:
+        args.workers = os.cpu_count() or 1
+    if args.clear_cache:
+        wave_cache.clear_cache()
+    return args
+
+
+def write_run_report(script, wave_reports, started, run_stages=None, options=None, output_path=None):
+    """
+    Write the script's run report (per-wave stage timings, see run_report.py)
+    next to the outputs and append it to the run history.
+    """
+    output_path = Path(output_path or OUTPUT_PATH)
+    report_file = output_path / run_report.report_file_name(script)
+    report = run_report.build_run_report(script, wave_reports, started, run_stages, options)
+    save_json(report, report_file, precompress=False)
+    run_report.append_history(report, output_path / run_report.RUN_HISTORY_NAME)
+    stages = ', '.join(f"{name} {entry['seconds']:.2f}s" for name, entry in report['stages'].items())
+    print(f"✓ Saved run report: {report_file} ({report['rows']:,} rows; {stages})")
+    return report_file
+
+
+def main(workers=1, use_cache=True):
+    """Main processing function."""
+    started = time.time()
+    print("\n" + "="*60)
+    print("Taiwan Social Change Survey - Wealth Data Preparation v2")
+    print("Processing 1992-2022 (7 survey waves)")
+    print("="*60)
+
+    all_records = {}
+    scores_by_year = {}
+    matrices_by_year = {}
+    wave_reports = {}
+    all_years = run_report.new_wave_report()
+
+    years = YEARS
+
+    process = partial(run_report.timed_wave, process_year, use_cache=use_cache)
+    for year, (records, report) in run_waves(process, years, workers):
         try:
-            records = process_year(year)
             all_records[year] = records
+            wave_reports[year] = report
+
+            with run_report.stage(report, 'aggregate'):
+                matrices_by_year[year] = sankey_matrix_from_records(records)
+                sankey_data = sankey_data_from_matrix(matrices_by_year[year], year)
+                scores_by_year[year] = calculate_wealth_scores(records)
 
-            sankey_data = generate_sankey_data(records, year)
             output_file = OUTPUT_PATH / f'wealth_data_{year}.json'
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(sankey_data, f, ensure_ascii=False, indent=2)
+            with run_report.stage(report, 'serialize'):
+                save_json(sankey_data, output_file)
+                remove_compact_sibling(output_file)
             print(f"  ✓ Saved: {output_file}")
 
-            scores = calculate_wealth_scores(records)
-            comparison_data['years'].append(year)
-            comparison_data['subjective_avg'].append(scores['subjective_avg'])
-            comparison_data['objective_avg'].append(scores['objective_avg'])
-            comparison_data['happiness_avg'].append(scores['happiness_avg'])
-            comparison_data['happiness_std'].append(scores['happiness_std'])
-
         except Exception as e:
             print(f"  ✗ Error processing {year}: {e}")
-            import traceback
             traceback.print_exc()
 
-    comparison_file = OUTPUT_PATH / 'comparison_data.json'
-    with open(comparison_file, 'w', encoding='utf-8') as f:
-        json.dump(comparison_data, f, ensure_ascii=False, indent=2)
-    print(f"\n✓ Saved comparison data: {comparison_file}")
+    # All-years outputs are timed once per run rather than per wave
+    with run_report.stage(all_years, 'aggregate'):
+        comparison_data = build_comparison_data(scores_by_year)
+        wealth_cube = build_wealth_cube(matrices_by_year, scores_by_year)
+
+    with run_report.stage(all_years, 'serialize'):
+        comparison_file = OUTPUT_PATH / 'comparison_data.json'
+        save_json(comparison_data, comparison_file)
+        print(f"\n✓ Saved comparison data: {comparison_file}")
+
+        cube_file = OUTPUT_PATH / 'wealth_cube.json'
+        save_json(wealth_cube, cube_file)
+        print(f"✓ Saved all-years cube: {cube_file}")
+
+        output_manifest.write_manifest()
+
+    write_run_report('prepare_wealth_data.py', wave_reports, started, all_years['stages'],
+                     {'workers': workers, 'use_cache': use_cache})
 
     print("\n" + "="*60)
     print("Processing Complete - Summary")
@@ -574,4 +1171,5 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    args = parse_args('Prepare Sankey and comparison data from TSCS waves.')
+    main(workers=args.workers, use_cache=args.use_cache)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing of the preparation scripts.
+Each wave gets a report ({'rows', 'stages': {stage: seconds}}) that the
+pipeline functions fill through stage(); each script writes its latest
+report to data/processed/run_report_<script>.json with rows/s for every wave
+and stage, and appends it to run_reports.jsonl, so slow waves and stages can
+be tracked across runs.
+"""
+
+import contextlib
+import json
+import time
+from datetime import datetime, timezone
+
+# Stages in pipeline order
+STAGES = ['load', 'decode', 'classify', 'aggregate', 'serialize']
+
+# Latest report of each script, and the history of all runs (one report per line)
+RUN_REPORT_PATTERN = 'run_report_*.json'
+RUN_HISTORY_NAME = 'run_reports.jsonl'
+
+
+def new_wave_report():
+    """Empty report of one wave"""
+    return {'rows': 0, 'stages': {}}
+
+
+@contextlib.contextmanager
+def stage(report, name):
+    """Add the time spent in the with-block to a stage of report (no-op for None)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if report is not None:
+            report['stages'][name] = report['stages'].get(name, 0.0) + time.perf_counter() - start
+
+
+def add_rows(report, rows):
+    """Count rows read for a wave"""
+    if report is not None:
+        report['rows'] += int(rows)
+
+
+def merge_wave_reports(a, b):
+    """Combine the reports of two parts of a wave (stage times are summed across processes)"""
+    stages = dict(a['stages'])
+    for name, seconds in b['stages'].items():
+        stages[name] = stages.get(name, 0.0) + seconds
+    return {'rows': a['rows'] + b['rows'], 'stages': stages}
+
+
+def timed_wave(func, year, **kwargs):
+    """
+    Run func(year, report=..., **kwargs) and return (result, report).
+    Module-level so it can be sent to worker processes by run_waves.
+    """
+    report = new_wave_report()
+    result = func(year, report=report, **kwargs)
+    return result, report
+
+
+def report_file_name(script):
+    """Name of a script's latest report, e.g. run_report_prepare_all_data.json"""
+    return RUN_REPORT_PATTERN.replace('*', script.removesuffix('.py'))
+
+
+def append_history(report, history_file):
+    """Append a report as one line of the run history"""
+    with open(history_file, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(report, ensure_ascii=False) + '\n')
+
+
+def rate(rows, seconds):
+    """Rows per second (None when nothing was timed)"""
+    return round(rows / seconds, 1) if seconds > 0 else None
+
+
+def summarize_stages(rows, stages):
+    """Seconds, rows/s and share of the total for each stage, in pipeline order"""
+    total = sum(stages.values())
+    ordered = [name for name in STAGES if name in stages] + [name for name in stages if name not in STAGES]
+    return {
+        name: {
+            'seconds': round(stages[name], 6),
+            'rows_per_s': rate(rows, stages[name]),
+            'share': round(stages[name] / total, 4) if total > 0 else None
+        }
+        for name in ordered
+    }
+
+
+def summarize_wave(year, report):
+    """JSON entry of one wave"""
+    seconds = sum(report['stages'].values())
+    return {
+        'year': year,
+        'rows': report['rows'],
+        'seconds': round(seconds, 6),
+        'rows_per_s': rate(report['rows'], seconds),
+        'stages': summarize_stages(report['rows'], report['stages'])
+    }
+
+
+def build_run_report(script, wave_reports, started, run_stages=None, options=None):
+    """
+    Assemble the run report from {year: wave report} and the stages timed
+    once per run (e.g. writing all-years files).
+    """
+    waves = [summarize_wave(year, report) for year, report in sorted(wave_reports.items())]
+
+    totals = {}
+    for report in wave_reports.values():
+        for name, seconds in report['stages'].items():
+            totals[name] = totals.get(name, 0.0) + seconds
+    rows = sum(report['rows'] for report in wave_reports.values())
+
+    slowest = None
+    for wave in waves:
+        for name, entry in wave['stages'].items():
+            if slowest is None or entry['seconds'] > slowest['seconds']:
+                slowest = {'year': wave['year'], 'stage': name, 'seconds': entry['seconds']}
+
+    return {
+        'script': script,
+        'started_at': datetime.fromtimestamp(started, timezone.utc).isoformat(timespec='seconds'),
+        'wall_seconds': round(time.time() - started, 6),
+        'options': options or {},
+        'rows': rows,
+        'stages': summarize_stages(rows, totals),
+        'run_stages': summarize_stages(rows, run_stages or {}),
+        'slowest': slowest,
+        'waves': waves
+    }
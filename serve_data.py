@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Caching static server for the visualization
+Serves the project directory like `python3 -m http.server`, but
+- answers with pre-compressed (.br / .gz) siblings when the browser accepts them
+- sends strong ETags computed from file content and answers If-None-Match with 304
+- lets browsers keep content-hashed filenames forever and revalidate the rest
+- keeps recently served files in memory, so repeated requests skip the disk
+- answers count queries over the survey cube at /api/query (see survey_cube.py)
+With --asyncio it runs on one event loop instead of a thread per request, and
+identical concurrent requests share a single file read or query.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+from functools import partial
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import output_manifest
+import static_compression
+import survey_cube
+
+DEFAULT_PORT = 8889
+
+# Files larger than this are read from disk on every request instead of cached
+HOT_CACHE_MAX_FILE_BYTES = 8 * 1024 * 1024
+
+# Least recently served files are dropped beyond this total
+HOT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# name.<hash>.ext, as written for content-addressed outputs
+HASHED_NAME_PATTERN = re.compile(r'\.[0-9a-f]{8,64}\.[A-Za-z0-9]+$')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+# path -> {'key': (mtime_ns, size), 'etag', 'data', 'size', 'mtime'}, least recently served first
+hot_cache = OrderedDict()
+hot_cache_bytes = 0
+hot_cache_lock = threading.Lock()
+
+# The survey cube, loaded on first query and reloaded when the file changes
+loaded_cube = {'key': None, 'cube': None}
+loaded_cube_lock = threading.Lock()
+
+
+def accepted_encodings(header):
+    """Content-Encodings listed in an Accept-Encoding header (q=0 excluded)"""
+    encodings = set()
+    for item in (header or '').split(','):
+        name, _, params = item.partition(';')
+        key, _, value = params.replace(' ', '').partition('=')
+        try:
+            if key == 'q' and float(value) == 0:
+                continue
+        except ValueError:
+            continue
+        if name.strip():
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def content_etag(data):
+    """Strong ETag for a file's content"""
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+
+def etag_matches(header, etag):
+    """True when an If-None-Match header matches the ETag"""
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+def cache_control(path):
+    """Cache-Control for a served file: forever for hashed names, revalidate otherwise"""
+    if HASHED_NAME_PATTERN.search(os.path.basename(path)):
+        return IMMUTABLE_CACHE_CONTROL
+    return REVALIDATE_CACHE_CONTROL
+
+
+def read_file(path):
+    """
+    Return {'etag', 'data', 'size', 'mtime'} for a file, from the hot cache
+    when it has not changed on disk. Large files are read but not cached.
+    """
+    global hot_cache_bytes
+
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with hot_cache_lock:
+        entry = hot_cache.get(path)
+        if entry is not None and entry['key'] == key:
+            hot_cache.move_to_end(path)
+            return entry
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    entry = {'key': key, 'etag': content_etag(data), 'data': data,
+             'size': len(data), 'mtime': stat.st_mtime}
+    if len(data) > HOT_CACHE_MAX_FILE_BYTES:
+        return entry
+
+    with hot_cache_lock:
+        old = hot_cache.pop(path, None)
+        if old is not None:
+            hot_cache_bytes -= old['size']
+        hot_cache[path] = entry
+        hot_cache_bytes += entry['size']
+        while hot_cache_bytes > HOT_CACHE_MAX_BYTES and len(hot_cache) > 1:
+            _, evicted = hot_cache.popitem(last=False)
+            hot_cache_bytes -= evicted['size']
+    return entry
+
+
+def get_survey_cube(cube_file=survey_cube.SURVEY_CUBE_FILE):
+    """The in-memory survey cube, reloaded only when its file changes (None if missing)"""
+    try:
+        stat = os.stat(cube_file)
+    except OSError:
+        return None
+    key = (stat.st_mtime_ns, stat.st_size)
+    with loaded_cube_lock:
+        if loaded_cube['key'] != key:
+            loaded_cube['cube'] = survey_cube.load_survey_cube(cube_file)
+            loaded_cube['key'] = key
+        return loaded_cube['cube']
+
+
+def parse_cube_query(query_string):
+    """
+    Parse ?group_by=year,gender&subjective=中層階級,上層階級 into
+    (filters, group_by); every parameter except group_by filters a dimension.
+    """
+    params = {name: [item for value in values for item in value.split(',') if item]
+              for name, values in parse_qs(query_string, keep_blank_values=True).items()}
+    group_by = params.pop('group_by', [])
+    filters = params
+    return filters, group_by
+
+
+def answer_api(path, query_string):
+    """(status, JSON-serializable body) for an /api/ request"""
+    cube = get_survey_cube()
+    if cube is None:
+        return HTTPStatus.SERVICE_UNAVAILABLE, {'error': 'survey cube not built; run prepare_all_data.py'}
+
+    if path == '/api/dims':
+        dims = dict(cube['dims'], county=sorted(set(cube['county_of_zip'])))
+        return HTTPStatus.OK, {'dims': dims, 'regions': dict(zip(cube['dims']['zip'], cube['regions']))}
+    if path == '/api/query':
+        filters, group_by = parse_cube_query(query_string)
+        try:
+            return HTTPStatus.OK, survey_cube.query_cube(cube, filters, group_by)
+        except ValueError as e:
+            return HTTPStatus.BAD_REQUEST, {'error': str(e)}
+    return HTTPStatus.NOT_FOUND, {'error': f'unknown endpoint: {path}'}
+
+
+def choose_representation(path, accept_encoding):
+    """(Content-Encoding or None, file to send) for the encodings the client accepts"""
+    accepted = accepted_encodings(accept_encoding)
+    for encoding in static_compression.ENCODING_SUFFIXES:
+        sibling = static_compression.compressed_path(path, encoding)
+        if (encoding in accepted or '*' in accepted) and sibling.is_file():
+            return encoding, str(sibling)
+    return None, path
+
+
+def guess_type(path):
+    """Content-Type of a served file"""
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def file_response(path, encoding, entry, if_none_match):
+    """(status, headers, body) for a file whose chosen representation was read into entry"""
+    # Each representation has its own ETag, so compressed and raw copies never mix
+    headers = {
+        'ETag': entry['etag'],
+        'Cache-Control': cache_control(path),
+        'Vary': 'Accept-Encoding'
+    }
+    if etag_matches(if_none_match, entry['etag']):
+        return HTTPStatus.NOT_MODIFIED, headers, b''
+
+    headers['Content-Type'] = guess_type(path)
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    headers['Content-Length'] = str(entry['size'])
+    headers['Last-Modified'] = formatdate(entry['mtime'], usegmt=True)
+    return HTTPStatus.OK, headers, entry['data']
+
+
+def api_response(path, query_string):
+    """(status, headers, body) for an /api/ request"""
+    status, body = answer_api(path, query_string)
+    data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    headers = {
+        'Content-Type': 'application/json; charset=utf-8',
+        'Content-Length': str(len(data)),
+        'Cache-Control': REVALIDATE_CACHE_CONTROL
+    }
+    return status, headers, data
+
+
+def error_response(status, message):
+    """(status, headers, body) for a plain-text error"""
+    data = f'{status.value} {message}\n'.encode('utf-8')
+    return status, {'Content-Type': 'text/plain; charset=utf-8', 'Content-Length': str(len(data))}, data
+
+
+class CachingFileHandler(SimpleHTTPRequestHandler):
+    """SimpleHTTPRequestHandler with compression, ETags, an in-memory cache and the query API"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def send_head(self):
+        url = urlsplit(self.path)
+        if url.path.startswith('/api/'):
+            return self.send_prepared(*api_response(url.path, url.query))
+
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().send_head()
+
+        encoding, served_path = choose_representation(path, self.headers.get('Accept-Encoding'))
+        try:
+            entry = read_file(served_path)
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, 'File not found')
+            return None
+        return self.send_prepared(*file_response(path, encoding, entry, self.headers.get('If-None-Match')))
+
+    def send_prepared(self, status, headers, body):
+        """Send a prepared response's headers and return its body (None for 304)"""
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        return None if status == HTTPStatus.NOT_MODIFIED else io.BytesIO(body)
+
+
+class DataServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer with a listen backlog sized for bursts of dashboard clients"""
+
+    request_queue_size = 1024
+
+
+# Asyncio mode: one event loop, with file reads and queries run in worker threads.
+# key -> task of the read or query in progress; only touched from the event loop
+in_flight = {}
+
+
+async def coalesced(key, func, *args):
+    """
+    Run func(*args) in a worker thread. Identical requests that arrive while
+    it runs await the same task instead of starting their own.
+    """
+    task = in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        in_flight[key] = task
+        task.add_done_callback(lambda _: in_flight.pop(key, None))
+    # shield: a client disconnecting must not cancel the read shared by the others
+    return await asyncio.shield(task)
+
+
+def translate_path(directory, url_path):
+    """Map a URL path to a file under directory (index.html for directories)"""
+    parts = [part for part in posixpath.normpath(unquote(url_path)).split('/')
+             if part and part not in ('.', '..')]
+    path = os.path.join(directory, *parts)
+    if os.path.isdir(path):
+        path = os.path.join(path, 'index.html')
+    return path
+
+
+async def async_response(method, target, headers, directory):
+    """(status, headers, body) for one request in asyncio mode"""
+    if method not in ('GET', 'HEAD'):
+        return error_response(HTTPStatus.NOT_IMPLEMENTED, 'Unsupported method')
+
+    url = urlsplit(target)
+    if url.path.startswith('/api/'):
+        return await coalesced(('api', url.path, url.query), api_response, url.path, url.query)
+
+    path = translate_path(directory, url.path)
+    if not os.path.isfile(path):
+        return error_response(HTTPStatus.NOT_FOUND, 'File not found')
+
+    encoding, served_path = choose_representation(path, headers.get('accept-encoding'))
+    try:
+        entry = await coalesced(('file', served_path), read_file, served_path)
+    except OSError:
+        return error_response(HTTPStatus.NOT_FOUND, 'File not found')
+    return file_response(path, encoding, entry, headers.get('if-none-match'))
+
+
+async def handle_connection(reader, writer, directory='.'):
+    """Serve the HTTP/1.1 requests of one (keep-alive) connection"""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            try:
+                method, target, version = request_line.decode('latin-1').split()
+            except ValueError:
+                method, target, version = 'GET', '/', 'HTTP/1.0'
+                response = error_response(HTTPStatus.BAD_REQUEST, 'Bad request')
+            else:
+                response = None
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            if response is None:
+                response = await async_response(method, target, headers, directory)
+            status, response_headers, body = response
+            keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+            lines = [f'HTTP/1.1 {status.value} {status.phrase}', f'Date: {formatdate(usegmt=True)}',
+                     f'Connection: {"keep-alive" if keep_alive else "close"}']
+            lines += [f'{name}: {value}' for name, value in response_headers.items()]
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+            if method != 'HEAD':
+                writer.write(body)
+            await writer.drain()
+
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_async(port, bind, directory):
+    server = await asyncio.start_server(partial(handle_connection, directory=directory),
+                                        bind or None, port, backlog=DataServer.request_queue_size)
+    async with server:
+        await server.serve_forever()
+
+
+def main(port=DEFAULT_PORT, bind='', directory='.', use_asyncio=False):
+    print("Compressing static assets...")
+    static_compression.compress_static_assets()
+    output_manifest.write_manifest()
+
+    mode = 'asyncio' if use_asyncio else 'threaded'
+    print(f"Serving {os.path.abspath(directory)} on http://{bind or 'localhost'}:{port} ({mode})")
+    try:
+        if use_asyncio:
+            asyncio.run(serve_async(port, bind, directory))
+        else:
+            handler = partial(CachingFileHandler, directory=directory)
+            with DataServer((bind, port), handler) as httpd:
+                httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the visualization and the survey cube query API.')
+    parser.add_argument('port', type=int, nargs='?', default=DEFAULT_PORT, help='port to listen on')
+    parser.add_argument('--bind', default='', help='address to bind (default: all interfaces)')
+    parser.add_argument('--asyncio', dest='use_asyncio', action='store_true',
+                        help='serve from one asyncio event loop, coalescing identical concurrent requests')
+    args = parser.parse_args()
+    main(port=args.port, bind=args.bind, use_asyncio=args.use_asyncio)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Pre-compressed (.gz / .br) siblings of the files the front end downloads.
+The pipeline writes them next to each output, and serve_data.py sends them
+with a Content-Encoding header instead of the raw file.
+brotli is listed in requirements.txt; if it is missing anyway, only .gz files
+are written and serve_data.py falls back to gzip.
+"""
+
+import argparse
+import gzip
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Served assets: (directory, glob pattern)
+STATIC_ASSETS = [
+    (Path('./data/processed'), '*.json'),
+    (Path('./data/processed'), '*.bin'),
+    (Path('./map'), '*_topo.json')
+]
+
+# Build artifacts in the asset directories that the front end never downloads
+UNSERVED_PATTERNS = ['run_report_*.json']
+
+# Content-Encoding -> sibling suffix, in order of preference
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def compressed_path(file_path, encoding):
+    """Path of a file's pre-compressed sibling for one Content-Encoding"""
+    file_path = Path(file_path)
+    return file_path.with_name(file_path.name + ENCODING_SUFFIXES[encoding])
+
+
+def compress_bytes(data, encoding):
+    """Compress data at maximum level; None if the encoding is unavailable"""
+    if encoding == 'gzip':
+        # mtime=0 keeps the output identical for identical input
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(data, quality=11)
+    return None
+
+
+def write_compressed_siblings(file_path):
+    """
+    Write the .gz (and .br) siblings of a file.
+    A sibling that cannot be written is removed so it is never served stale.
+    Returns {encoding: size in bytes} of the siblings written.
+    """
+    data = Path(file_path).read_bytes()
+    sizes = {}
+    for encoding in ENCODING_SUFFIXES:
+        sibling = compressed_path(file_path, encoding)
+        compressed = compress_bytes(data, encoding)
+        if compressed is None:
+            sibling.unlink(missing_ok=True)
+        else:
+            sibling.write_bytes(compressed)
+            sizes[encoding] = len(compressed)
+    return sizes
+
+
+def remove_compressed_siblings(file_path):
+    """Remove a file's pre-compressed siblings"""
+    for encoding in ENCODING_SUFFIXES:
+        compressed_path(file_path, encoding).unlink(missing_ok=True)
+
+
+def is_compressed_current(file_path):
+    """True when every sibling that can be written exists and is newer than the file"""
+    mtime = Path(file_path).stat().st_mtime_ns
+    for encoding in ENCODING_SUFFIXES:
+        if encoding == 'br' and brotli is None:
+            continue
+        sibling = compressed_path(file_path, encoding)
+        if not sibling.exists() or sibling.stat().st_mtime_ns < mtime:
+            return False
+    return True
+
+
+def asset_files(assets=STATIC_ASSETS):
+    """Every served asset file, in directory and name order"""
+    for directory, pattern in assets:
+        for file_path in sorted(directory.glob(pattern)):
+            if not any(file_path.match(unserved) for unserved in UNSERVED_PATTERNS):
+                yield file_path
+
+
+def compress_static_assets(assets=STATIC_ASSETS, force=False):
+    """Write missing or outdated siblings for every served asset"""
+    for file_path in asset_files(assets):
+        if force or not is_compressed_current(file_path):
+            sizes = write_compressed_siblings(file_path)
+            size = file_path.stat().st_size
+            summary = ', '.join(f'{enc} {n:,}' for enc, n in sizes.items())
+            print(f"  ✓ Compressed: {file_path} ({size:,} bytes -> {summary})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write .gz/.br siblings of the served data and map files.')
+    parser.add_argument('--force', action='store_true', help='recompress files whose siblings are up to date')
+    args = parser.parse_args()
+    if brotli is None:
+        print("brotli not installed; writing .gz only")
+    compress_static_assets(force=args.force)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Year × zip × age group × gender × subjective × objective × sample count cube.
+prepare_all_data.py writes it to data/processed/survey_cube.npz; serve_data.py
+loads it once and answers filtered, grouped count queries with NumPy slicing
+and summing instead of re-reading the .sav files.
+
+Every dimension has an explicit unknown slot, so no respondent is dropped.
+The 'sample' dimension separates respondents excluded from the Sankey and
+score outputs (1992 housewives): filter sample=included to reproduce them.
+"""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+SURVEY_CUBE_FILE = Path('./data/processed/survey_cube.npz')
+
+UNKNOWN_LABEL = '未知'
+
+GENDER_CODES = {1: '男', 2: '女'}
+SAMPLE_LABELS = ['included', 'excluded']
+
+# Axis order of the cube; 'county' is derived from the zip regions
+DIMENSIONS = ['year', 'zip', 'age', 'gender', 'subjective', 'objective', 'sample']
+DERIVED_DIMENSIONS = ['county']
+
+# Spelling variants in the waves' region labels -> the spelling of map/Taiwan_COUNTY_topo.json
+REGION_SPELLINGS = {'\u3000': '', '台': '臺', '苖': '苗'}
+
+# Counties merged into (or upgraded to) special municipalities in 2010 and 2014;
+# earlier waves are counted under the current county so time series line up
+MERGED_COUNTIES = {
+    '臺北縣': '新北市',
+    '臺中縣': '臺中市',
+    '臺南縣': '臺南市',
+    '高雄縣': '高雄市',
+    '桃園縣': '桃園市'
+}
+
+
+def with_unknown(labels):
+    """Dimension labels followed by the unknown slot"""
+    return list(labels) + [UNKNOWN_LABEL]
+
+
+def gender_codes(values):
+    """Map raw gender codes to positions in with_unknown(GENDER_CODES)"""
+    values = np.asarray(values, dtype=float)
+    codes = np.full(len(values), len(GENDER_CODES), dtype=np.int64)
+    for position, code in enumerate(GENDER_CODES):
+        codes[values == code] = position
+    return codes
+
+
+def count_respondents(zip_labels, codes, tail_shape):
+    """
+    Count one wave (or chunk) into a zip × tail_shape cube.
+    zip_labels holds each respondent's zip label; codes holds one code array
+    per remaining dimension (unknown values already mapped to the last slot).
+    """
+    zip_index, zip_values = np.unique(np.asarray(zip_labels, dtype=str), return_inverse=True)
+    shape = (len(zip_index),) + tuple(tail_shape)
+    flat_index = np.ravel_multi_index((zip_values.ravel(),) + tuple(codes), shape)
+    counts = np.bincount(flat_index, minlength=int(np.prod(shape))).reshape(shape)
+    return {'zip': zip_index.tolist(), 'counts': counts}
+
+
+def empty_wave_counts(tail_shape):
+    """Counts with no respondents (identity for merge_wave_counts)"""
+    return {'zip': [], 'counts': np.zeros((0,) + tuple(tail_shape), dtype=np.int64)}
+
+
+def merge_wave_counts(a, b):
+    """Combine the counts of two chunks of a wave, aligning them on zip labels"""
+    known = set(a['zip'])
+    zip_labels = a['zip'] + [z for z in b['zip'] if z not in known]
+    position = {z: i for i, z in enumerate(zip_labels)}
+
+    counts = np.zeros((len(zip_labels),) + a['counts'].shape[1:], dtype=np.int64)
+    counts[:len(a['zip'])] += a['counts']
+    counts[[position[z] for z in b['zip']]] += b['counts']
+    return {'zip': zip_labels, 'counts': counts}
+
+
+def zip_sort_key(label):
+    """Numeric zip order, unknown last"""
+    return (label == UNKNOWN_LABEL, int(label) if label.isdigit() else 0, label)
+
+
+def build_survey_cube(counts_by_year, regions_by_year, labels):
+    """
+    Stack per-wave counts into one cube.
+    labels gives the labels of the dimensions after zip (age … sample);
+    a zip's region is taken from the latest wave that reports it.
+    """
+    years = sorted(counts_by_year)
+    zip_labels = sorted({z for year in years for z in counts_by_year[year]['zip']}, key=zip_sort_key)
+    position = {z: i for i, z in enumerate(zip_labels)}
+
+    regions = {}
+    for year in years:
+        regions.update(regions_by_year[year])
+
+    tail_shape = tuple(len(values) for values in labels.values())
+    counts = np.zeros((len(years), len(zip_labels)) + tail_shape, dtype=np.uint32)
+    for i, year in enumerate(years):
+        wave = counts_by_year[year]
+        counts[i, [position[z] for z in wave['zip']]] = wave['counts']
+
+    dims = {'year': years, 'zip': zip_labels}
+    dims.update(labels)
+    return {'dims': dims, 'regions': [regions.get(z, UNKNOWN_LABEL) for z in zip_labels], 'counts': counts}
+
+
+def wave_counts_from_cube(cube, year):
+    """Per-wave counts and regions of one year in a cube (None if absent)"""
+    if year not in cube['dims']['year']:
+        return None
+    wave = cube['counts'][cube['dims']['year'].index(year)]
+    present = wave.reshape(len(wave), -1).sum(axis=1) > 0
+    zip_labels = [z for z, keep in zip(cube['dims']['zip'], present) if keep]
+    counts = {'zip': zip_labels, 'counts': wave[present].astype(np.int64)}
+    regions = {z: r for z, r, keep in zip(cube['dims']['zip'], cube['regions'], present) if keep}
+    return counts, regions
+
+
+def save_survey_cube(cube, cube_file=SURVEY_CUBE_FILE):
+    """Write a cube as a compressed .npz (counts plus a JSON description)"""
+    description = json.dumps({'dims': cube['dims'], 'regions': cube['regions']}, ensure_ascii=False)
+    tmp_file = Path(cube_file).with_name(f'.{Path(cube_file).name}.{os.getpid()}.tmp')
+    with open(tmp_file, 'wb') as f:
+        np.savez_compressed(f, counts=cube['counts'], description=np.array(description))
+    tmp_file.replace(cube_file)
+
+
+def load_survey_cube(cube_file=SURVEY_CUBE_FILE):
+    """Load a cube written by save_survey_cube, or None if there is none"""
+    try:
+        with np.load(cube_file) as data:
+            description = json.loads(str(data['description']))
+            counts = data['counts'].astype(np.int64)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    cube = {'dims': description['dims'], 'regions': description['regions'], 'counts': counts}
+    # Derived dimension: the (current) county of each zip's region
+    cube['county_of_zip'] = [county_of_region(region) for region in cube['regions']]
+    return cube
+
+
+def county_of_region(region):
+    """
+    Current county of a zip's region label (e.g. '臺中縣\u3000大\u3000安' -> '臺中市').
+    Labels differ across waves in spelling and county boundaries, so they are
+    normalized before the county (first three characters) is taken.
+    """
+    if region == UNKNOWN_LABEL:
+        return UNKNOWN_LABEL
+    for variant, spelling in REGION_SPELLINGS.items():
+        region = region.replace(variant, spelling)
+    county = region[:3]
+    return MERGED_COUNTIES.get(county, county)
+
+
+def select_positions(labels, wanted):
+    """Positions of the labels listed in wanted (compared as strings)"""
+    wanted = {str(value) for value in wanted}
+    return [i for i, label in enumerate(labels) if str(label) in wanted]
+
+
+def query_cube(cube, filters=None, group_by=()):
+    """
+    Sum the cube over everything not in group_by, keeping only the labels in
+    filters ({dimension: [labels]}). Returns the group labels and a nested
+    list of counts in group_by order.
+    """
+    filters = filters or {}
+    group_by = list(group_by)
+    known = set(cube['dims']) | set(DERIVED_DIMENSIONS)
+    for name in list(filters) + group_by:
+        if name not in known:
+            raise ValueError(f"unknown dimension: {name}")
+    if len(set(group_by)) != len(group_by) or {'zip', 'county'} <= set(group_by):
+        raise ValueError("group_by must not repeat a dimension or combine zip and county")
+
+    counts = cube['counts']
+    labels = {}
+    for axis, name in enumerate(DIMENSIONS):
+        positions = range(len(cube['dims'][name]))
+        if name in filters:
+            positions = select_positions(cube['dims'][name], filters[name])
+        if name == 'zip' and 'county' in filters:
+            wanted = [county_of_region(str(county)) for county in filters['county']]
+            in_county = set(select_positions(cube['county_of_zip'], wanted))
+            positions = [i for i in positions if i in in_county]
+        if len(positions) != len(cube['dims'][name]):
+            counts = np.take(counts, positions, axis=axis)
+        labels[name] = [cube['dims'][name][i] for i in positions]
+        if name == 'zip':
+            zip_positions = list(positions)
+
+    keep = [name for name in DIMENSIONS if name in group_by or (name == 'zip' and 'county' in group_by)]
+    counts = counts.sum(axis=tuple(i for i, name in enumerate(DIMENSIONS) if name not in keep))
+
+    if 'county' in group_by:
+        axis = keep.index('zip')
+        counties = [cube['county_of_zip'][i] for i in zip_positions]
+        county_labels = sorted(set(counties), key=lambda c: (c == UNKNOWN_LABEL, c))
+        county_index = np.array([county_labels.index(c) for c in counties], dtype=np.int64)
+        grouped = np.zeros(counts.shape[:axis] + (len(county_labels),) + counts.shape[axis + 1:], dtype=np.int64)
+        np.add.at(np.moveaxis(grouped, axis, 0), county_index, np.moveaxis(counts, axis, 0))
+        counts = grouped
+        keep[axis] = 'county'
+        labels['county'] = county_labels
+
+    counts = np.transpose(counts, [keep.index(name) for name in group_by])
+    return {
+        'group_by': group_by,
+        'labels': {name: labels[name] for name in group_by},
+        'counts': counts.tolist(),
+        'total': int(counts.sum())
+    }
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Synthetic TSCS waves for benchmarks and scaling tests.
+A synthetic wave has the same columns (get_used_columns) and value labels as
+the real wave of that year; each column is sampled independently from the
+real wave's marginal distribution, including missing codes (90+) and NaN.
+write_synthetic_sav writes one as a .sav file with the real codebook, so the
+whole pipeline can be run on production-sized inputs.
+"""
+
+import argparse
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pyreadstat
+
+import prepare_grid_visualization_data as grid_module
+
+pwd_module = grid_module.pwd_module
+
+SYNTHETIC_PATH = Path('./data/synthetic')
+
+
+def wave_marginals(year, use_cache=True):
+    """
+    Marginal distribution of every used column of a real wave.
+    Returns ({column: (values, probabilities)}, meta).
+    """
+    df, meta = pwd_module.load_data(year, use_cache=use_cache)
+    marginals = {}
+    for column in df.columns:
+        counts = df[column].value_counts(dropna=False, sort=False)
+        marginals[column] = (counts.index.to_numpy(), (counts / counts.sum()).to_numpy())
+    return marginals, meta
+
+
+def synthetic_wave(year, n_rows, seed=0, marginals=None):
+    """
+    Sample an (df, meta) wave of n_rows respondents for a year.
+    meta carries what the pipeline reads (column names, row count, value labels).
+    Pass marginals from wave_marginals to avoid reloading the real wave.
+    """
+    if marginals is None:
+        marginals = wave_marginals(year)
+    column_marginals, real_meta = marginals
+
+    rng = np.random.default_rng([seed, year])
+    df = pd.DataFrame({
+        column: rng.choice(values, size=n_rows, p=probabilities)
+        for column, (values, probabilities) in column_marginals.items()
+    })
+    meta = SimpleNamespace(
+        column_names=list(df.columns),
+        number_rows=n_rows,
+        variable_value_labels={name: labels for name, labels in real_meta.variable_value_labels.items()
+                               if name in column_marginals}
+    )
+    return df, meta
+
+
+def missing_codes(labels):
+    """Non-answer codes of one variable (labelled 不知道, 拒答, 跳答, ...; usually 9x or 99x)"""
+    return [code for code, label in labels.items()
+            if any(marker in label for marker in pwd_module.MISSING_LABEL_MARKERS)]
+
+
+def missing_code_share(df, meta):
+    """Share of each labelled column's values that are non-answer codes or NaN"""
+    shares = {}
+    for column in df.columns:
+        codes = missing_codes(meta.variable_value_labels.get(column, {}))
+        if codes:
+            values = df[column].to_numpy(dtype=float)
+            shares[column] = float(np.mean(np.isnan(values) | np.isin(values, codes)))
+    return shares
+
+
+def write_synthetic_sav(year, n_rows, output_path=SYNTHETIC_PATH, seed=0, marginals=None):
+    """
+    Write a synthetic wave of n_rows as output_path/<the real file name>.
+    Variable names, labels, value labels, formats, measures and declared
+    missing ranges are copied from the real wave's metadata.
+    Returns (output file, df).
+    """
+    meta = pwd_module.load_metadata(year)
+    df, _ = synthetic_wave(year, n_rows, seed, marginals)
+    columns = list(df.columns)
+
+    output_file = Path(output_path) / pwd_module.FILE_MAPPING[year]
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    pyreadstat.write_sav(
+        df, str(output_file),
+        file_label=f'Synthetic TSCS {year} ({n_rows:,} rows, seed {seed})',
+        column_labels={c: meta.column_names_to_labels.get(c) for c in columns},
+        variable_value_labels={c: meta.variable_value_labels[c] for c in columns
+                               if c in meta.variable_value_labels},
+        missing_ranges={c: meta.missing_ranges[c] for c in columns if c in meta.missing_ranges} or None,
+        variable_measure={c: meta.variable_measure[c] for c in columns if c in meta.variable_measure},
+        variable_format={c: meta.original_variable_types[c] for c in columns},
+        row_compress=True
+    )
+    return output_file, df
+
+
+def main(years=pwd_module.YEARS, rows=10 ** 5, output_path=SYNTHETIC_PATH, seed=0):
+    print("=" * 60)
+    print(f"Synthetic TSCS waves: {rows:,} rows each -> {output_path}")
+    print("=" * 60)
+
+    for year in years:
+        output_file, df = write_synthetic_sav(year, rows, output_path, seed)
+        meta = pwd_module.load_metadata(year)
+        shares = ', '.join(f'{column} {share:.1%}' for column, share in missing_code_share(df, meta).items())
+        print(f"  ✓ {year}: {output_file} ({output_file.stat().st_size:,} bytes)")
+        print(f"    missing codes: {shares}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic .sav waves with the real codebooks.')
+    parser.add_argument('--years', type=int, nargs='*', default=pwd_module.YEARS,
+                        help='waves to synthesize (default: all)')
+    parser.add_argument('--rows', type=float, default=10 ** 5, help='rows per wave (e.g. 1e6)')
+    parser.add_argument('--output', type=Path, default=SYNTHETIC_PATH, help='directory for the .sav files')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+    main(years=args.years, rows=int(args.rows), output_path=args.output, seed=args.seed)
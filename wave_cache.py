@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of decoded SPSS waves.
+Each entry stores the projected columns as memory-mappable .npy files plus a
+JSON file with the value labels, so later runs skip pyreadstat decoding.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+CACHE_PATH = Path('./data/cache')
+
+# Least recently used entries are evicted beyond this size
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Bump when the entry layout changes so old entries are ignored
+CACHE_FORMAT_VERSION = 1
+
+
+def file_fingerprint(file_path):
+    """Identify an input file by path, size, mtime and content hash."""
+    file_path = Path(file_path)
+    stat = file_path.stat()
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    return {
+        'path': str(file_path.resolve()),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': sha256.hexdigest()
+    }
+
+
+def get_cache_key(file_path, usecols):
+    """Cache key for a projection of one .sav file."""
+    payload = {
+        'version': CACHE_FORMAT_VERSION,
+        'file': file_fingerprint(file_path),
+        'usecols': list(usecols)
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load_cached_wave(cache_key, cache_path=CACHE_PATH):
+    """
+    Return (df, meta) for a cached wave, or None on a cache miss.
+    Columns are memory-mapped read-only; meta only carries what the
+    pipeline uses (column names, row count and value labels).
+    """
+    entry = cache_path / cache_key
+    try:
+        with open(entry / 'meta.json', encoding='utf-8') as f:
+            info = json.load(f)
+        columns = {
+            name: np.load(entry / f'col_{i:03d}.npy', mmap_mode='r')
+            for i, name in enumerate(info['column_names'])
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+
+    # Touch the entry so eviction keeps recently used waves
+    os.utime(entry / 'meta.json')
+
+    df = pd.DataFrame(columns, columns=info['column_names'], copy=False)
+    meta = SimpleNamespace(
+        column_names=info['column_names'],
+        number_rows=info['number_rows'],
+        variable_value_labels={
+            var_name: {code: label for code, label in pairs}
+            for var_name, pairs in info['variable_value_labels'].items()
+        }
+    )
+    return df, meta
+
+
+def store_cached_wave(cache_key, df, meta, cache_path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+    """
+    Store a decoded wave. Waves with non-numeric columns are not cached.
+    Returns True when the entry was written.
+    """
+    if not all(pd.api.types.is_numeric_dtype(dtype) for dtype in df.dtypes):
+        return False
+
+    entry = cache_path / cache_key
+    tmp_entry = cache_path / f'.{cache_key}.{os.getpid()}.tmp'
+    tmp_entry.mkdir(parents=True, exist_ok=True)
+
+    column_names = [str(name) for name in df.columns]
+    for i, name in enumerate(df.columns):
+        np.save(tmp_entry / f'col_{i:03d}.npy', df[name].to_numpy(), allow_pickle=False)
+
+    info = {
+        'column_names': column_names,
+        'number_rows': len(df),
+        'variable_value_labels': {
+            var_name: [[code, label] for code, label in labels.items()]
+            for var_name, labels in meta.variable_value_labels.items()
+        }
+    }
+    with open(tmp_entry / 'meta.json', 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False)
+
+    try:
+        tmp_entry.rename(entry)
+    except OSError:
+        # Another process stored the same wave first
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    prune_cache(max_bytes, cache_path)
+    return True
+
+
+def get_entry_size(entry):
+    """Total size in bytes of one cache entry."""
+    return sum(f.stat().st_size for f in entry.iterdir())
+
+
+def prune_cache(max_bytes=CACHE_MAX_BYTES, cache_path=CACHE_PATH):
+    """Evict least recently used entries until the cache fits in max_bytes."""
+    if not cache_path.exists():
+        return
+    entries = [e for e in cache_path.iterdir() if e.is_dir() and not e.name.startswith('.')]
+    entries.sort(key=lambda e: (e / 'meta.json').stat().st_mtime if (e / 'meta.json').exists() else 0)
+
+    total = sum(get_entry_size(e) for e in entries)
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        total -= get_entry_size(entry)
+        shutil.rmtree(entry, ignore_errors=True)
+
+
+def clear_cache(cache_path=CACHE_PATH):
+    """Remove every cached wave."""
+    if cache_path.exists():
+        shutil.rmtree(cache_path)